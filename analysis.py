@@ -4,6 +4,8 @@ import os
 import ast
 import re
 
+from event_log import read_raw_log
+
 def load_phrases(filename='phrases2.txt'):
     """フレーズリストを読み込む"""
     try:
@@ -34,10 +36,28 @@ def levenshtein_distance(s1, s2):
         previous_row = current_row
     return previous_row[-1]
 
+def parse_event_data(evt_data_str):
+    """CSVのEventData (文字列化された辞書) をパースする"""
+    try:
+        if isinstance(evt_data_str, str) and (evt_data_str.startswith('{') or evt_data_str.startswith('"')):
+            if evt_data_str.startswith('"') and evt_data_str.endswith('"'):
+                evt_data_str = evt_data_str[1:-1]
+            return ast.literal_eval(evt_data_str)
+        return evt_data_str
+    except:
+        return {}
+
+def event_column(df, name):
+    """イベントのデータを展開した列 (Data.<キー>)。そのキーが1度も出てこなければ空の列"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(None, index=df.index, dtype=object)
+
 def process_raw_log(file_path, phrases):
     """1つのRawログファイルを処理してDataFrameを返す"""
     try:
-        df = pd.read_csv(file_path)
+        # _raw.arrow があれば文字列をパースせずに読み込む
+        df = read_raw_log(file_path, parse_event_data)
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         return None
@@ -79,38 +99,19 @@ def process_raw_log(file_path, phrases):
             target_phrase = ""
 
         # 入力文の復元 (confirmイベントをつなげる)
+        # 順序が意味を持つのは confirm / undo だけなので、その行だけをたどる
         input_words = []
-        backspace_count = 0
-        
-        for _, row in group.iterrows():
-            evt_type = row['EventType']
-            evt_data_str = row['EventData']
-            
-            # EventDataは文字列化された辞書なのでパースする
-            try:
-                if isinstance(evt_data_str, str) and (evt_data_str.startswith('{') or evt_data_str.startswith('"')):
-                    if evt_data_str.startswith('"') and evt_data_str.endswith('"'):
-                        evt_data_str = evt_data_str[1:-1]
-                    evt_data = ast.literal_eval(evt_data_str)
-                else:
-                    evt_data = evt_data_str
-            except:
-                evt_data = {}
-
+        edits = group[group['EventType'].isin(['confirm', 'undo'])]
+        for evt_type, word in zip(edits['EventType'], event_column(edits, 'Data.word')):
             if evt_type == 'confirm':
-                if isinstance(evt_data, dict) and 'word' in evt_data:
-                    input_words.append(evt_data['word'])
-            
-            elif evt_type == 'undo':
-                if input_words:
-                    input_words.pop()
-            
-            elif evt_type == 'keydown':
-                # Backspaceカウント
-                if isinstance(evt_data, dict) and evt_data.get('key') == 'Backspace':
-                    backspace_count += 1
-                elif isinstance(evt_data, str) and evt_data == 'Backspace':
-                    backspace_count += 1
+                if isinstance(word, str):
+                    input_words.append(word)
+            elif input_words:
+                input_words.pop()
+
+        # Backspaceカウント (データが {"key": ...} の場合と文字列の場合がある)
+        is_backspace = (event_column(group, 'Data.key') == 'Backspace') | (event_column(group, 'Data') == 'Backspace')
+        backspace_count = int(((group['EventType'] == 'keydown') & is_backspace).sum())
 
         input_phrase = " ".join(input_words)
         
@@ -126,7 +127,7 @@ def process_raw_log(file_path, phrases):
         start_time = group['ClientTimestamp'].min()
         
         # Trial 1 で system: test_started があればそれを使う
-        start_evts = group[group['EventData'].astype(str).str.contains('test_started', na=False)]
+        start_evts = group[event_column(group, 'Data') == 'test_started']
         if not start_evts.empty:
             start_time = start_evts.iloc[0]['ClientTimestamp']
         
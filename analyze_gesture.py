@@ -4,6 +4,8 @@ import glob
 import os
 import sys
 
+from event_log import read_raw_log
+
 def parse_event_data(data_str):
     """EventDataカラムのJSON文字列または辞書をパースする"""
     if isinstance(data_str, dict):
@@ -23,37 +25,30 @@ def parse_event_data(data_str):
 def process_raw_log(filepath):
     """RawログからSummaryデータを抽出する"""
     try:
-        df = pd.read_csv(filepath)
+        # _raw.arrow があれば文字列をパースせずに読み込む (EventData は Data.<キー> の列に展開済み)
+        df = read_raw_log(filepath, parse_event_data)
     except Exception as e:
         print(f"Error reading {filepath}: {e}")
         return None
 
-    results = []
-
-    # 行ごとに処理
-    for index, row in df.iterrows():
-        # EventDataをパース
-        event_data = parse_event_data(row.get('EventData', '{}'))
-        
-        # 'state_change' イベントで、かつ 'rt_ms' (反応時間) が含まれている行を探す
-        # これが試行完了のタイミング
-        if row['EventType'] == 'state_change' and isinstance(event_data, dict):
-            if 'rt_ms' in event_data:
-                results.append({
-                    'Timestamp': row['ServerTimestampISO'],
-                    'ParticipantID': row['ParticipantID'],
-                    'Condition': row['Condition'],
-                    'Handedness': row['Handedness'],
-                    'TrialID': int(row['TrialID']),
-                    'TargetGesture': row['TargetGesture'],
-                    'TargetID': row['TargetID'],
-                    'ReactionTime': float(event_data['rt_ms'])
-                })
-
-    if not results:
+    # 'state_change' イベントで、かつ 'rt_ms' (反応時間) が含まれている行を探す
+    # これが試行完了のタイミング
+    if 'Data.rt_ms' not in df.columns:
         return None
-        
-    return pd.DataFrame(results)
+    done = df[(df['EventType'] == 'state_change') & df['Data.rt_ms'].notna()]
+    if done.empty:
+        return None
+
+    return pd.DataFrame({
+        'Timestamp': done['ServerTimestampISO'],
+        'ParticipantID': done['ParticipantID'],
+        'Condition': done['Condition'],
+        'Handedness': done['Handedness'],
+        'TrialID': done['TrialID'].astype(int),
+        'TargetGesture': done['TargetGesture'],
+        'TargetID': done['TargetID'],
+        'ReactionTime': done['Data.rt_ms'].astype(float)
+    }).reset_index(drop=True)
 
 def main():
     log_dir = "logs_gesture"
@@ -1,24 +1,176 @@
 import os
 import json
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from word_predictor import WordPredictor
+import signal
+import sys
+import threading
+import time
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+from word_predictor import ADAPTIVE_WIDTH, REVERSE_QWERTY_MAP, PredictionCancelled, WordPredictor, memory_usage
+from prediction_cache import SharedPredictionCache
+from prediction_service import PredictionService
 from typing_test import TypingTest
+from user_adaptation import UserCacheStore
 from gesture_test import GestureTest 
+from event_log import ARROW_AVAILABLE
 # 新規インポート
 from nasa_tlx import nasa_tlx_bp
 
 # --- モデルとロジックの初期化 ---
+# 軽量構成: 'char_ngram.npz' (文字n-gramモデル) を指定すると、KenLMモデルをダウンロードせずに数十msで起動できる
 model_path = 'wiki_en_token.arpa.bin'
+# KenLM のモデルの読み込み方法 ("lazy" / "populate" / "read" / "parallel_read", word_predictor.LOAD_METHODS 参照)
+# 1台で複数のサーバーを動かすときは "lazy" か "populate" にすると、モデルのページを全プロセスで共有できる
+# 環境変数 KENLM_LOAD_METHOD でも指定できる
+model_load_method = os.environ.get('KENLM_LOAD_METHOD', 'populate')
+# 語彙制約モード: 語彙ファイル (例: 'words.json') を指定すると実在する単語だけを候補にする
+lexicon_path = None
+# 短いキー列の予測表 (build_prediction_table.py で作成した .ptab)。指定すると文頭の数キーは表を引くだけで答える
+table_path = None
+# モデルの語彙の索引 (モデルの ARPA から build_key_index.py で作成した .kidx)。指定するとビームサーチの採点をまとめて行う
+vocabulary_path = None
+# /predict のビーム幅。"auto" ならスコア差に応じてステップごとに自動で決める
+predict_beam_width = ADAPTIVE_WIDTH
+# /predict 1回あたりの目安時間 [ms]。超えそうなら残りのステップは幅を絞る (None で無制限)
+predict_latency_budget_ms = 20
+# 予測結果をプロセス間 (複数のワーカー・再起動後) で共有するキャッシュ (SQLite) と容量の上限 [MB]。None なら使わない
+shared_cache_path = os.path.join('logs', 'prediction_cache.sqlite3')
+shared_cache_max_mb = 256
+# /predict を同時に実行する数。同じセッションの新しい入力が来たら古い予測は取り消し、同じ入力の予測は1回にまとめる
+predict_workers = 4
+# 参加者ごとの適応 (確定した単語のキャッシュモデル) の保存先と補間の重み。None なら適応しない
+adaptation_dir = os.path.join('logs', 'adaptation')
+adaptation_weight = 0.2
+# 起動時にバックグラウンドでモデルを読み込む (False なら最初のリクエストで読み込む)
+preload_model = True
+# debug のリローダー (ソースの変更で再起動) を使うか。環境変数 FLASK_USE_RELOADER=0 で無効にできる (Docker では無効)
+# リローダーの監視用の親プロセスは SIGTERM を受けるとサーバーの子プロセスを SIGKILL するので、
+# docker stop でログを書き出して終了させるには、サーバーが PID 1 のプロセスで動くように無効にしておく
+use_reloader = os.environ.get('FLASK_USE_RELOADER', '1') != '0'
+# 読み込み後の空打ちに使うフレーズ数 (0 なら空打ちしない)
+warm_up_phrases = 5
 _predictor = None
+_predictor_lock = threading.Lock()
+_adaptation = None
+_prediction_service = None
+# モデル読み込みの進み具合 (/readyz で返す)
+_load_status = {"state": "idle", "started": None, "finished": None, "error": None}
+_start_time = time.time()
 
 def get_predictor():
+    """
+    予測器を返す。まだ読み込まれていなければ読み込む
+    バックグラウンドで読み込み中なら、終わるまで待つ (ロックを持っているのは読み込み側)。
+    """
     global _predictor
     if _predictor is None:
-        print("[App] Loading model...")
-        _predictor = WordPredictor(model_path)
-        print("[App] Model loaded.")
+        with _predictor_lock:
+            if _predictor is None:
+                _load_predictor()
     return _predictor
 
+def _load_predictor(next_state="ready"):
+    """モデルを読み込む (_predictor_lock を持って呼ぶこと)。読み込み後の状態を next_state にする"""
+    global _predictor
+    _load_status.clear()
+    _load_status.update(state="loading", started=time.time(), finished=None, error=None)
+    if isinstance(model_path, str) and not os.path.exists(model_path):
+        # get_model.sh でダウンロードする (進み具合はファイルサイズで分かる)
+        _load_status["state"] = "downloading"
+    print("[App] Loading model...")
+    try:
+        shared_cache = None
+        if shared_cache_path is not None and isinstance(model_path, str):
+            shared_cache = SharedPredictionCache(shared_cache_path, max_bytes=shared_cache_max_mb * 1024 * 1024)
+        _predictor = WordPredictor(model_path, lexicon=lexicon_path, table=table_path,
+                                   vocabulary=vocabulary_path, load_method=model_load_method,
+                                   shared_cache=shared_cache)
+    except Exception as e:
+        _load_status.update(state="error", error=str(e), finished=time.time())
+        raise
+    _load_status.update(state=next_state, finished=time.time(), load_method=model_load_method,
+                        load_seconds=_predictor.load_seconds, load_memory_mb=_predictor.load_memory)
+    print("[App] Model loaded.")
+
+def _preload_predictor():
+    """起動時にバックグラウンドスレッドで実行する: モデルの読み込みと空打ち"""
+    warm_up = bool(warm_up_phrases and tester.phrases)
+    loaded = False
+    try:
+        with _predictor_lock:
+            if _predictor is None:
+                # 空打ちが終わるまでは ready にしない
+                _load_predictor("warming_up" if warm_up else "ready")
+                loaded = True
+    except Exception as e:
+        print(f"[App] Model loading failed: {e}")
+        return
+    if warm_up:
+        start = time.perf_counter()
+        count = _predictor.warm_up(tester.phrases[:warm_up_phrases], beam_width=predict_beam_width,
+                                   latency_budget_ms=predict_latency_budget_ms)
+        _load_status.update(warm_up_predictions=count, warm_up_seconds=time.perf_counter() - start)
+        # 先にリクエストが読み込んだ場合は既に ready なので、状態は戻さない (このスレッドが読み込んだときだけ進める)
+        if loaded:
+            _load_status["state"] = "ready"
+        print(f"[App] Warm-up done ({count} predictions)")
+
+def start_preload():
+    thread = threading.Thread(target=_preload_predictor, name="model-preload", daemon=True)
+    thread.start()
+    return thread
+
+def _memory_usage():
+    """現在のメモリ使用量 [MB] (取得できない環境では None)"""
+    usage = memory_usage()
+    usage["max_rss_mb"] = None
+    try:
+        import resource
+        usage["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+    return usage
+
+def get_prediction_service():
+    global _prediction_service
+    if _prediction_service is None:
+        with _predictor_lock:
+            if _prediction_service is None:
+                _prediction_service = PredictionService(predict_workers)
+    return _prediction_service
+
+def get_user_model(participant_id):
+    """参加者の適応モデル (適応しない設定なら None)"""
+    global _adaptation
+    if adaptation_dir is None:
+        return None
+    if _adaptation is None:
+        _adaptation = UserCacheStore(adaptation_dir, adaptation_weight)
+    return _adaptation.get(participant_id)
+
+def _positive_int(value, name):
+    """リクエストの値を正の整数にする (不正なら ValueError。呼び出し側で 400 を返す)"""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{name} must be a positive integer")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a positive integer") from None
+    if number <= 0:
+        raise ValueError(f"{name} must be a positive integer")
+    return number
+
+def _non_negative_float(value, name):
+    """リクエストの値を0以上の数にする (不正なら ValueError。呼び出し側で 400 を返す)"""
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a non-negative number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a non-negative number") from None
+    if not number >= 0 or number == float('inf'):
+        raise ValueError(f"{name} must be a non-negative number")
+    return number
+
 # =================================================
 #  【修正】パス設定 (app.pyより移植)
 # =================================================
@@ -42,6 +194,10 @@ if not os.path.exists(GESTURES_PATH):
 if not os.path.exists(IMAGES_DIR):
     print(f"[App] CRITICAL WARNING: Images directory NOT FOUND at {IMAGES_DIR}")
 
+# pyarrow は依存関係に含まれているが、uv sync 以外で入れた環境では無いことがある
+if not ARROW_AVAILABLE:
+    print("[App] WARNING: pyarrow not installed. Raw logs are saved as _raw.csv only (no _raw.arrow)")
+
 # タイピングテスト用
 tester = TypingTest()
 # phrases2.txtが存在しない場合のエラー回避
@@ -67,28 +223,120 @@ app.register_blueprint(nasa_tlx_bp)
 
 @app.route('/', methods=['GET'])
 def index():
-    predictor = get_predictor()
+    # キー対応表はモデルが無くても分かるので、読み込みを待たずにページを返す
     return render_template('index.html', 
-                           js_reverse_map=json.dumps(predictor.REVERSE_QWERTY_MAP))
+                           js_reverse_map=json.dumps(REVERSE_QWERTY_MAP))
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """プロセスが応答できるか (モデルの読み込み状況に関係なく 200)"""
+    return jsonify({"status": "ok", "uptime_seconds": time.time() - _start_time, "memory": _memory_usage()})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """予測を受け付けられるか (モデルの読み込みと空打ちが終わっていれば 200、それまでは 503)"""
+    status = dict(_load_status)
+    now = time.time()
+    if status["started"] is not None:
+        status["elapsed_seconds"] = (status["finished"] or now) - status["started"]
+    if status["state"] == "downloading" and isinstance(model_path, str) and os.path.exists(model_path):
+        status["downloaded_mb"] = os.path.getsize(model_path) / (1024 * 1024)
+    status["memory"] = _memory_usage()
+    if _prediction_service is not None:
+        status["prediction_service"] = _prediction_service.stats()
+    if _predictor is not None and _predictor.shared_cache is not None:
+        status["shared_cache"] = _predictor.shared_cache.stats()
+    ready = status["state"] == "ready"
+    return jsonify({"ready": ready, **status}), 200 if ready else 503
 
 @app.route('/predict', methods=['POST'])
 def predict():
     predictor = get_predictor()
     data = request.json
     input_word = data.get('word', '').strip()
+    # 同じフレーズで既に確定した単語 (左文脈)。省略時は文頭として扱う
+    context = data.get('context', [])
+    # クライアントごとの入力状態を分けるためのID。省略時は共有の既定セッション
+    session = predictor.session(data.get('session_id'))
+    # 入力している参加者の適応モデルで順位を補正する (省略時はタイピングテスト中の参加者)
+    # session_id の無いリクエストは既定セッションを共有するので、セッションには設定せずリクエストごとに渡す
+    adaptation = get_user_model(data.get('participant_id', tester.participant_id))
 
     if not input_word:
-        predictor.clear()
+        session.clear()
         return jsonify({"predictions": [], "converted_index": "", "total_combinations": 0})
 
-    predictor.set_text_input(input_word)
-    ranked_predictions = predictor.predict_top_words_with_scores(limit=10,beam_width=10000)
+    limit = 10
+    latency_budget_ms = data.get('latency_budget_ms', predict_latency_budget_ms)
+    if latency_budget_ms is not None:
+        # 予測をまとめるキーと時間予算の計算に使うので、数値に揃えておく
+        try:
+            latency_budget_ms = _non_negative_float(latency_budget_ms, "latency_budget_ms")
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+    converted_index, ctx = session.prepare_text(input_word, context)
+    total_combinations = predictor.count_qwerty_combinations(converted_index)
+    # 同じ入力 (キー列・文脈・設定) のリクエストは1回の予測にまとめる (適応による補正はリクエストごとに行う)
+    key = (converted_index, ctx.words, predict_beam_width, limit, latency_budget_ms)
+    try:
+        candidates = []
+        if converted_index:
+            candidates = get_prediction_service().run(
+                data.get('session_id'), key,
+                lambda cancel: predictor.decode(converted_index, predict_beam_width, ctx, session.frontier_cache,
+                                                latency_budget_ms, limit, cancel=cancel))
+    except PredictionCancelled:
+        # 同じセッションの新しい入力に置き換えられた (クライアントはこの応答を無視する)
+        return jsonify({"predictions": [], "superseded": True, "input_word": input_word,
+                        "converted_index": converted_index, "total_combinations": total_combinations})
+    candidates = session.adapt(candidates, converted_index, ctx, limit, adaptation)
 
     return jsonify({
-        "predictions": ranked_predictions,
+        "predictions": [{"word": word, "score": score} for score, word in candidates],
         "input_word": input_word,
-        "converted_index": predictor.current_index_sequence,
-        "total_combinations": predictor.qwerty_combinations
+        "converted_index": converted_index,
+        "total_combinations": total_combinations
+    })
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    複数の入力をまとめて予測する
+    リクエスト: {"words": [...]} または {"sequences": [...]} (キー列)
+               任意で "contexts": [[確定済みの単語, ...], ...], "limit", "beam_width" (整数または "auto")
+    """
+    predictor = get_predictor()
+    data = request.json or {}
+    if 'sequences' in data:
+        inputs = [str(seq) for seq in data.get('sequences', [])]
+        sequences = inputs
+    else:
+        inputs = [str(word).strip() for word in data.get('words', [])]
+        sequences = [predictor.text_to_sequence(word) for word in inputs]
+
+    contexts = data.get('contexts')
+    if contexts is not None and len(contexts) != len(sequences):
+        return jsonify({"status": "error", "message": "contexts must have the same length as the inputs"}), 400
+
+    try:
+        beam_width = data.get('beam_width', 10000)
+        if beam_width != ADAPTIVE_WIDTH:
+            beam_width = _positive_int(beam_width, "beam_width")
+        limit = _positive_int(data.get('limit', 10), "limit")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    predictions = predictor.predict_many(
+        sequences,
+        limit=limit,
+        beam_width=beam_width,
+        contexts=contexts)
+
+    return jsonify({
+        "results": [
+            {"input": text, "converted_index": seq, "predictions": preds}
+            for text, seq, preds in zip(inputs, sequences, predictions)
+        ]
     })
 
 @app.route('/log', methods=['POST'])
@@ -113,6 +361,9 @@ def start_test():
         data.get('handedness', 'R')
     )
     tester.loadReferenceText()
+    user_model = get_user_model(tester.participant_id)
+    if user_model is not None:
+        user_model.new_phrase()
     return jsonify({'reference_text': tester.getReferenceText()})
 
 @app.route('/test/next', methods=['POST'])
@@ -121,6 +372,9 @@ def next_phrase():
     if events:
         tester.log_client_events(events)
     tester.loadReferenceText()
+    user_model = get_user_model(tester.participant_id)
+    if user_model is not None:
+        user_model.new_phrase()
     return jsonify({'reference_text': tester.getReferenceText()})
 
 @app.route('/test/check', methods=['POST'])
@@ -132,6 +386,17 @@ def check_input():
         tester.log_client_events(events)
     
     result = tester.check_input(committed_words)
+
+    # 正しく確定できた単語 (先頭から連続する分) を参加者の適応モデルに覚えさせる
+    user_model = get_user_model(tester.participant_id)
+    if user_model is not None:
+        confirmed = []
+        for r in result["results"]:
+            if not r["is_correct"]:
+                break
+            confirmed.append(r["word"])
+        if user_model.confirm(confirmed):
+            user_model.save()
     return jsonify(result)
 
 
@@ -174,6 +439,30 @@ def get_gesture_state():
     state = gesture_tester.check_state()
     return jsonify(state)
 
+# /gesture/stream で変化が無いときに送るコメント行の間隔 [s] (切れた接続を検出するため)
+GESTURE_STREAM_KEEPALIVE = 15.0
+
+@app.route('/gesture/stream', methods=['GET'])
+def gesture_state_stream():
+    """
+    ジェスチャーテストの状態を Server-Sent Events で送る (/gesture/state のポーリングの代わり)
+    状態・入力・マッチの有無などが変わったときだけ、/gesture/state と同じ形の JSON を1件送る。
+    カウントダウンの終了などの時間経過による遷移も、GestureTest のタイマーが行ったときに通知される。
+    """
+    def events():
+        version = None
+        while True:
+            state = gesture_tester.check_state()
+            if state.get("version") != version:
+                version = state.get("version")
+                yield f"id: {version}\ndata: {json.dumps(state)}\n\n"
+
+            if gesture_tester.wait_for_change(version, GESTURE_STREAM_KEEPALIVE) == version:
+                yield ": keepalive\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/gesture/log', methods=['POST'])
 def gesture_log():
     try:
@@ -188,4 +477,9 @@ def gesture_log():
 
 if __name__ == '__main__':
     app.config['TEMPLATES_AUTO_RELOAD'] = True
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # docker stop などの SIGTERM でも通常の終了処理 (atexit: ログの書き出し) を行う
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # debug のリロード時は監視用の親プロセスでも実行されるので、実際に動く子プロセスでだけ読み込む
+    if preload_model and (not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        start_preload()
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=use_reloader)
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+/predict のキー入力ごとの遅延ベンチマーク
+
+phrases2.txt のフレーズを実際の入力と同じように1キーずつ打ち込んだストリームにして
+(確定済みの単語を左文脈として渡し、ときどきバックスペースも混ぜる)、
+以下の2経路で1キーごとの遅延を計測する。
+    api  : PredictionSession.predict_text を直接呼ぶ
+    http : Flask のテストクライアントで POST /predict を呼ぶ (ルーティング・JSON変換込み)
+
+ビーム幅・入力中の文字数ごとに p50/p90/p99/max を出力し、JSONのベースラインとして保存・比較できる。
+実験前にデコーダの速度が落ちていないか確認する用途を想定している。
+
+使い方:
+    python benchmark_predict.py --save-baseline benchmark_baseline.json
+    python benchmark_predict.py --compare benchmark_baseline.json   # 遅くなっていれば終了コード1
+    python benchmark_predict.py --modes api --widths 1000 10000 100000 --phrases 50
+    python benchmark_predict.py --modes api --widths 10000 auto --latency-budget-ms 20
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+from word_predictor import ADAPTIVE_WIDTH
+
+BACKSPACE_RATE = 0.05
+PERCENTILES = (50, 90, 99)
+
+
+def load_phrases(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = re.sub(r'\[source:\s*\d+\]', '', f.read())
+    return [line.strip().lower() for line in content.split('\n') if line.strip()]
+
+
+def keystroke_stream(phrases, seed):
+    """
+    フレーズを1キーずつの入力に展開する
+    :return: [(入力中の単語, 確定済みの単語リスト), ...]
+    """
+    rng = random.Random(seed)
+    stream = []
+    for phrase in phrases:
+        committed = []
+        for word in phrase.split():
+            for length in range(1, len(word) + 1):
+                stream.append((word[:length], list(committed)))
+                # 打ち間違えて消した、という操作を混ぜる
+                if length > 1 and rng.random() < BACKSPACE_RATE:
+                    stream.append((word[:length - 1], list(committed)))
+                    stream.append((word[:length], list(committed)))
+            committed.append(word)
+    return stream
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(samples):
+    """[(文字数, 遅延ms), ...] を文字数ごと + 全体の統計にまとめる"""
+    by_length = {}
+    for length, ms in samples:
+        by_length.setdefault(length, []).append(ms)
+    by_length["all"] = [ms for _, ms in samples]
+
+    summary = {}
+    for length, values in by_length.items():
+        stats = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+        stats["max"] = max(values)
+        stats["count"] = len(values)
+        summary[str(length)] = stats
+    return summary
+
+
+def beam_width(value):
+    """--widths の値: 整数または "auto" """
+    return value if value == ADAPTIVE_WIDTH else int(value)
+
+
+def run_api(predictor, stream, width, limit, latency_budget_ms=None):
+    session = predictor.session(f"bench-api-{width}-{time.time_ns()}")
+    samples = []
+    for text, committed in stream:
+        start = time.perf_counter()
+        session.predict_text(text, context=committed, limit=limit, beam_width=width,
+                             latency_budget_ms=latency_budget_ms)
+        samples.append((len(text), (time.perf_counter() - start) * 1000))
+    predictor.drop_session(session.session_id)
+    return samples
+
+
+def run_http(client, stream):
+    session_id = f"bench-http-{time.time_ns()}"
+    samples = []
+    for text, committed in stream:
+        start = time.perf_counter()
+        res = client.post('/predict', json={"word": text, "context": committed, "session_id": session_id})
+        res.get_json()
+        samples.append((len(text), (time.perf_counter() - start) * 1000))
+    return samples
+
+
+def compare(results, baseline, tolerance):
+    """ベースラインより p50/p99 が tolerance 倍を超えて遅くなった項目を返す"""
+    regressions = []
+    for key, summary in results.items():
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        for length, stats in summary.items():
+            base_stats = base.get(length)
+            if not base_stats:
+                continue
+            for metric in ("p50", "p99"):
+                if base_stats[metric] > 0 and stats[metric] > base_stats[metric] * tolerance:
+                    regressions.append((key, length, metric, base_stats[metric], stats[metric]))
+    return regressions
+
+
+def print_summary(results):
+    print(f"\n{'run':>14} {'chars':>6} {'count':>6} {'p50ms':>9} {'p90ms':>9} {'p99ms':>9} {'maxms':>9}")
+    for key, summary in results.items():
+        lengths = sorted((k for k in summary if k != "all"), key=int) + ["all"]
+        for length in lengths:
+            s = summary[length]
+            print(f"{key:>14} {length:>6} {s['count']:>6} {s['p50']:>9.2f} {s['p90']:>9.2f} {s['p99']:>9.2f} {s['max']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="wiki_en_token.arpa.bin")
+    parser.add_argument("--phrases-file", default="phrases2.txt")
+    parser.add_argument("--phrases", type=int, default=20, help="使うフレーズ数 (seedで固定して抽出)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--widths", type=beam_width, nargs="+", default=[1000, 10000])
+    parser.add_argument("--latency-budget-ms", type=float, default=None, help="api モードで使う1回あたりの目安時間")
+    parser.add_argument("--modes", nargs="+", choices=["api", "http"], default=["api", "http"])
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--save-baseline", default=None, help="結果をベースラインJSONとして保存する")
+    parser.add_argument("--compare", default=None, help="ベースラインJSONと比較する")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="比較時に許容する遅延の倍率")
+    args = parser.parse_args()
+
+    phrases = load_phrases(args.phrases_file)
+    phrases = random.Random(args.seed).sample(phrases, min(args.phrases, len(phrases)))
+    stream = keystroke_stream(phrases, args.seed)
+    print(f"{len(phrases)} phrases, {len(stream)} keystrokes")
+
+    import app as app_module
+    app_module.model_path = args.model
+    # 共有キャッシュ (ディスクに残る) が有効だと2回目以降はキャッシュのヒットを計ることになり、
+    # デコーダの性能の変化を比較できないので、ベンチマークでは使わない
+    app_module.shared_cache_path = None
+    predictor = app_module.get_predictor()
+
+    results = {}
+    for mode in args.modes:
+        if mode == "http":
+            # /predict はビーム幅をサーバー側で決めるので1回だけ計測する
+            client = app_module.app.test_client()
+            results["http"] = summarize(run_http(client, stream))
+            continue
+        for width in args.widths:
+            results[f"api-{width}"] = summarize(run_api(predictor, stream, width, args.limit, args.latency_budget_ms))
+
+    print_summary(results)
+
+    if args.save_baseline:
+        baseline = {
+            "created": datetime.now().isoformat(),
+            "python": sys.version.split()[0],
+            "machine": platform.platform(),
+            "args": vars(args),
+            "results": results,
+        }
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"\nSaved baseline: {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions (> {args.tolerance:.2f}x baseline):")
+            for key, length, metric, before, after in regressions:
+                print(f"  {key} chars={length} {metric}: {before:.2f}ms -> {after:.2f}ms")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
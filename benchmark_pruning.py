@@ -0,0 +1,114 @@
+"""
+ビームの枝刈り (上位width件の選択) 方法ごとの速度比較
+
+1ステップで生成される候補数は最大 width × 6 (QWERTY_MAP['4'], ['7'] が6文字)。
+旧実装の「(score, word) タプルを全件ソートしてスライス」と、
+word_predictor.select_top の各方法 (partition / heap / sort) を比較する。
+どの方法も旧実装と同じ結果 (同点はインデックス順) を返すことも確認する。
+
+使い方:
+    python benchmark_pruning.py
+    python benchmark_pruning.py --widths 1000 10000 100000 --repeat 5
+    python benchmark_pruning.py --model wiki_en_token.arpa.bin   # 実モデルでのビームサーチ全体も計測
+"""
+import argparse
+import random
+import statistics
+import time
+from array import array
+
+from word_predictor import PRUNE_METHODS, select_top
+
+BRANCHING = 6
+# 実モデルでは多くの候補が未知語になり同じスコアが並ぶので、その割合を再現する
+UNK_RATIO = 0.7
+UNK_SCORE = -7.5
+
+
+def make_candidates(n, seed=0):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(n)]
+    scores = array('d', (
+        UNK_SCORE if rng.random() < UNK_RATIO else rng.uniform(-12.0, -2.0)
+        for _ in range(n)
+    ))
+    return words, scores
+
+
+def time_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def bench_selection(widths, repeat):
+    print(f"{'width':>8} {'candidates':>11} {'method':>10} {'ms':>10} {'speedup':>8}")
+    for width in widths:
+        n = width * BRANCHING
+        words, scores = make_candidates(n)
+
+        def legacy():
+            hyps = list(zip(scores, words))
+            hyps.sort(key=lambda x: x[0], reverse=True)
+            return hyps[:width]
+
+        baseline = time_ms(legacy, repeat)
+        print(f"{width:>8} {n:>11} {'legacy':>10} {baseline:>10.2f} {1.0:>7.1f}x")
+        expected = legacy()
+
+        for method in PRUNE_METHODS:
+            def run(method=method):
+                return [(scores[i], words[i]) for i in select_top(scores, width, method)]
+            if run() != expected:
+                raise AssertionError(f"select_top(method={method!r}) の結果が旧実装と一致しません (width={width})")
+            ms = time_ms(run, repeat)
+            print(f"{width:>8} {n:>11} {method:>10} {ms:>10.2f} {baseline / ms:>7.1f}x")
+
+
+def bench_model(model_path, widths, repeat, words):
+    from word_predictor import WordPredictor
+
+    print(f"\n{'width':>8} {'prune':>10} {'ms/word':>10}")
+    for width in widths:
+        results = {}
+        for prune in ("legacy",) + PRUNE_METHODS:
+            if prune == "legacy":
+                predictor = WordPredictor(model_path, decoder="legacy", cache_max_bytes=0)
+            else:
+                predictor = WordPredictor(model_path, cache_max_bytes=0, prune=prune)
+
+            def run():
+                outputs = []
+                for word in words:
+                    predictor.set_text_input(word)
+                    outputs.append(predictor.predict_top_words(limit=10, beam_width=width))
+                return outputs
+
+            results[prune] = run()
+            ms = time_ms(run, repeat) / len(words)
+            print(f"{width:>8} {prune:>10} {ms:>10.2f}")
+
+        # 枝刈りの方法は速度だけが違い、予測結果は同じでなければならない
+        for prune in PRUNE_METHODS[1:]:
+            if results[prune] != results[PRUNE_METHODS[0]]:
+                raise AssertionError(f"prune={prune!r} の予測結果が prune={PRUNE_METHODS[0]!r} と一致しません (width={width})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--widths", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model", default=None, help="KenLMモデルを指定するとビームサーチ全体も計測する")
+    parser.add_argument("--words", nargs="+", default=["keyboard", "unfortunate", "experience"])
+    args = parser.parse_args()
+
+    bench_selection(args.widths, args.repeat)
+    if args.model:
+        bench_model(args.model, args.widths, max(1, args.repeat // 2), args.words)
+
+
+if __name__ == "__main__":
+    main()
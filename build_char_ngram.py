@@ -0,0 +1,41 @@
+"""
+文字 n-gram モデル (.npz) を手元のコーパスから学習する
+
+KenLM の単語モデル (wiki_en_token.arpa.bin, 1GB以上) を get_model.sh でダウンロードせずに
+動かしたいとき (デモ・開発用の軽量構成) に使う。
+作成したモデルは WordPredictor("char_ngram.npz") や app.py の model_path に指定すれば読み込まれる。
+
+使い方:
+    python build_char_ngram.py char_ngram.npz
+    python build_char_ngram.py char_ngram.npz --corpus words.json phrases2.txt --order 6
+"""
+import argparse
+import os
+import time
+
+from char_ngram import CHAR_NGRAM_SUFFIX, CharNgramModel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help=f"出力するモデルファイル ({CHAR_NGRAM_SUFFIX})")
+    parser.add_argument("--corpus", nargs="+", default=["words.json"],
+                        help="学習に使うファイル (words.json 形式 / 1行1文のテキスト)")
+    parser.add_argument("--order", type=int, default=5)
+    args = parser.parse_args()
+
+    if not args.output.endswith(CHAR_NGRAM_SUFFIX):
+        parser.error(f"出力ファイルの拡張子は {CHAR_NGRAM_SUFFIX} にしてください (WordPredictor が拡張子で判別するため)")
+
+    start = time.perf_counter()
+    model = CharNgramModel.from_files(args.corpus, args.order)
+    model.save(args.output)
+    print(f"Built in {time.perf_counter() - start:.2f}s ({os.path.getsize(args.output) / 1024:.1f} KB)")
+
+    start = time.perf_counter()
+    CharNgramModel.load(args.output)
+    print(f"Loaded in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
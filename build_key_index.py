@@ -0,0 +1,41 @@
+"""
+語彙制約モード用の索引ファイル (.kidx) を作成する
+
+一度作っておけば WordPredictor(lexicon="xxx.kidx") で mmap して使えるので、
+起動時に語彙からキー列を計算し直す必要がなくなる。
+モデルの ARPA から作った索引は WordPredictor(vocabulary="xxx.kidx") にも使える
+(ビームサーチの各ステップを語彙の単語だけ KenLM で採点する、まとめて採点する経路)。
+
+使い方:
+    python build_key_index.py words.json words.kidx
+    python build_key_index.py wiki_en_token.arpa wiki_en_token.kidx
+"""
+import argparse
+import time
+
+from key_index import KeySequenceIndex, MappedKeySequenceIndex
+from word_predictor import REVERSE_QWERTY_MAP
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="語彙ファイル (words.json / .arpa / 1行1単語)")
+    parser.add_argument("output", help="出力する索引ファイル (.kidx)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = KeySequenceIndex.from_file(args.source, REVERSE_QWERTY_MAP)
+    index.save(args.output)
+    print(f"Built in {time.perf_counter() - start:.2f}s")
+
+    # 保存した索引が元と同じ結果を返すか確認する
+    mapped = MappedKeySequenceIndex(args.output, REVERSE_QWERTY_MAP)
+    for sequence in list(index.words_by_sequence)[:1000]:
+        assert mapped.words(sequence) == index.words(sequence), sequence
+    for sequence in list(index.prefixes_by_sequence)[:1000]:
+        assert mapped.prefixes(sequence) == index.prefixes(sequence), sequence
+    print(f"Verified {args.output} ({len(mapped)} words)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+短いキー列の予測表ファイル (.ptab) を作成する
+
+長さ 1 〜 --max-length の全キー列について、文頭 (左文脈なし) での予測結果を
+ビームサーチで求めて保存する。WordPredictor(table="xxx.ptab") で読み込むと、
+それらのキー列は探索せずに表を1回引くだけで予測できる。
+
+キー8種類で長さ4なら 4680 通り、長さ5なら 37448 通り。
+--beam-width がキー列の組み合わせ数 (最大 6^長さ) 以上なら、表の結果は全候補を採点した厳密な上位になる。
+
+使い方:
+    python build_prediction_table.py wiki_en_token.ptab
+    python build_prediction_table.py wiki_en_token.ptab --max-length 5 --top-k 20
+"""
+import argparse
+import os
+import time
+
+from prediction_table import PredictionTable, all_sequences
+from word_predictor import QWERTY_MAP, WordPredictor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help="出力する予測表ファイル (.ptab)")
+    parser.add_argument("--model", default="wiki_en_token.arpa.bin")
+    parser.add_argument("--max-length", type=int, default=4, help="表に入れるキー列の最大長")
+    parser.add_argument("--top-k", type=int, default=20, help="キー列ごとに保存する候補数")
+    parser.add_argument("--beam-width", type=int, default=10000)
+    args = parser.parse_args()
+
+    predictor = WordPredictor(args.model, cache_max_bytes=0)
+    sequences = all_sequences(QWERTY_MAP, args.max_length)
+    print(f"Decoding {len(sequences)} sequences (max_length={args.max_length}, beam_width={args.beam_width})")
+
+    start = time.perf_counter()
+    results = predictor.predict_many(sequences, limit=args.top_k, beam_width=args.beam_width)
+    predictions = {
+        seq: [(c["score"], c["word"]) for c in candidates]
+        for seq, candidates in zip(sequences, results)
+    }
+    print(f"Decoded in {time.perf_counter() - start:.2f}s")
+
+    info = {
+        "model": os.path.basename(args.model),
+        "model_bytes": os.path.getsize(args.model),
+        "decoder": predictor.decoder,
+        "beam_width": args.beam_width,
+    }
+    PredictionTable.save(args.output, predictions, QWERTY_MAP, args.max_length, args.top_k, info)
+
+    # 保存した表が元と同じ結果を返すか確認する (スコアは float32 で保存しているので順位と単語を比べる)
+    table = PredictionTable(args.output, QWERTY_MAP)
+    for seq in sequences[:1000] + sequences[-1000:]:
+        assert [w for _, w in table.lookup(seq)] == [w for _, w in predictions[seq]], seq
+    print(f"Verified {args.output} ({os.path.getsize(args.output) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import json
+import os
+import re
+
+import numpy as np
+
+# 文字 n-gram モデルのファイル拡張子 (WordPredictor はこの拡張子なら KenLM ではなくこちらを読み込む)
+CHAR_NGRAM_SUFFIX = ".npz"
+# 単語の区切り (文頭も区切りの直後として扱う)
+BOUNDARY = " "
+ALPHABET = BOUNDARY + "abcdefghijklmnopqrstuvwxyz"
+
+
+class CharState:
+    """CharNgramModel の状態 (直近 order-1 文字の履歴)。kenlm.State に相当する"""
+    __slots__ = ("history",)
+
+    def __init__(self):
+        self.history = ""
+
+
+class CharNgramModel:
+    """
+    文字 n-gram 言語モデル (Witten-Bell 補間)
+
+    WordPredictor から見た採点インターフェースは kenlm.Model と同じ
+    (order / State / BeginSentenceWrite / BaseScore / score) なので、モデルを差し替えるだけで使える。
+    単語トークンのモデルと違い、入力途中の単語を1文字ずつ採点するので、
+    未知語の先頭部分でも「英語らしさ」で順位が付く。
+
+    学習時に出現した履歴ごとに、次の文字の分布 (log10) を補間済みの状態で保存しておくので、
+    採点は「出現した最長の履歴を引いて配列を読む」だけで済む。
+    ファイルは NumPy の .npz (数百KB程度) で、読み込みは数ミリ秒。
+    """
+    State = CharState
+
+    def __init__(self, order, histories, logprobs):
+        """
+        :param order: n-gram の次数 (履歴は order-1 文字)
+        :param histories: 学習時に出現した履歴の文字列のリスト
+        :param logprobs: 各履歴の次の文字の分布 (log10, shape = (len(histories), len(ALPHABET)))
+        """
+        self.order = order
+        self._history_length = order - 1
+        self.logprobs = np.asarray(logprobs, dtype=np.float32)
+        self._rows = {history: i for i, history in enumerate(histories)}
+        self._char_index = {char: i for i, char in enumerate(ALPHABET)}
+
+    # =========================================================
+    #  採点 (kenlm.Model 互換)
+    # =========================================================
+
+    def BeginSentenceWrite(self, state):
+        state.history = BOUNDARY
+
+    def NullContextWrite(self, state):
+        state.history = ""
+
+    def BaseScore(self, in_state, word, out_state):
+        """
+        履歴 in_state に続けて word の各文字が出る確率 (log10) の和を返す
+        入力途中の単語も採点するので、単語末尾の区切りの確率は含めない。
+        out_state には word と区切りを読み進めた履歴を書き込む (次の単語の文脈用)。
+        """
+        history = in_state.history
+        total = 0.0
+        for char in _normalize(word):
+            total += float(self._distribution(history)[self._char_index[char]])
+            history = self._tail(history + char)
+        out_state.history = self._tail(history + BOUNDARY)
+        return total
+
+    def score(self, sentence, bos=True, eos=True):
+        """文全体 (単語間の区切りを含む) の確率 (log10)"""
+        history = BOUNDARY if bos else ""
+        text = BOUNDARY.join(_normalize(w) for w in sentence.split())
+        if eos:
+            text += BOUNDARY
+        total = 0.0
+        for char in text:
+            total += float(self._distribution(history)[self._char_index[char]])
+            history = self._tail(history + char)
+        return total
+
+    def score_extensions(self, in_state, parents, parent_scores, chars):
+        """
+        ビームサーチ1ステップ分をまとめて採点する
+        各親の仮説 (入力途中の単語) に chars の各文字を付けた候補のスコアを、
+        親のスコア + 次の文字の確率 で求める (親ごとに分布を1回引くだけ)。
+        :return: 候補のスコア (float64, 親の順 × chars の順に並べた1次元配列)
+        """
+        context = in_state.history
+        columns = [self._char_index[char] for char in chars]
+        rows = np.fromiter(
+            (self._row(self._tail(context + parent)) for parent in parents),
+            dtype=np.intp, count=len(parents))
+        scores = self.logprobs[rows][:, columns].astype(np.float64)
+        scores += np.asarray(parent_scores, dtype=np.float64)[:, None]
+        return scores.ravel()
+
+    def _tail(self, history):
+        """履歴を直近 order-1 文字に切り詰める"""
+        return history[max(0, len(history) - self._history_length):] if self._history_length else ""
+
+    def _row(self, history):
+        """学習時に出現した最長の履歴の行番号 (空の履歴は必ずある)"""
+        rows = self._rows
+        for start in range(len(history) + 1):
+            row = rows.get(history[start:])
+            if row is not None:
+                return row
+        return rows[""]
+
+    def _distribution(self, history):
+        return self.logprobs[self._row(history)]
+
+    # =========================================================
+    #  学習・保存
+    # =========================================================
+
+    @classmethod
+    def train(cls, sentences, order=5):
+        """
+        単語列のリストから学習する (Witten-Bell 補間)
+        P(c|h) = (C(h,c) + T(h) * P(c|h')) / (C(h) + T(h))
+            T(h): h の後に出現した文字の種類数, h': h の先頭1文字を落とした履歴
+        出現した全ての履歴について、この分布を計算して保持する。
+        """
+        if order < 1:
+            raise ValueError(f"order は1以上にしてください: {order}")
+
+        counts = {}
+        for words in sentences:
+            text = BOUNDARY + BOUNDARY.join(words) + BOUNDARY
+            for i in range(1, len(text)):
+                char = text[i]
+                for length in range(0, min(order - 1, i) + 1):
+                    history = text[i - length:i]
+                    row = counts.get(history)
+                    if row is None:
+                        row = counts[history] = np.zeros(len(ALPHABET), dtype=np.float64)
+                    row[ALPHABET.index(char)] += 1
+        if "" not in counts:
+            raise ValueError("学習データが空です")
+
+        # 短い履歴から順に分布を決める (長い履歴は1文字短い履歴の分布で補間する)
+        histories = sorted(counts, key=lambda h: (len(h), h))
+        probs = {}
+        uniform = np.full(len(ALPHABET), 1.0 / len(ALPHABET))
+        for history in histories:
+            row = counts[history]
+            lower = probs[history[1:]] if history else uniform
+            total = row.sum()
+            types = np.count_nonzero(row)
+            probs[history] = (row + types * lower) / (total + types)
+
+        logprobs = np.log10(np.stack([probs[h] for h in histories]))
+        return cls(order, histories, logprobs)
+
+    @classmethod
+    def from_files(cls, paths, order=5):
+        """
+        テキストファイルから学習する
+        - .json : words.json 形式 (1単語を1文として扱う)
+        - その他: 1行1文のテキスト (phrases2.txt など)
+        """
+        sentences = []
+        for path in paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"コーパスが見つかりません: {path}")
+            if path.endswith(".json"):
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                words = data.get('words', []) if isinstance(data, dict) else data
+                sentences.extend([w] for w in words if isinstance(w, str))
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                content = re.sub(r'\[source:\s*\d+\]', '', f.read())
+            sentences.extend(line.split() for line in content.split('\n') if line.strip())
+
+        sentences = [[w for w in map(_normalize, words) if w] for words in sentences]
+        model = cls.train([s for s in sentences if s], order)
+        print(f"[CharNgramModel] Trained order={order} on {len(sentences)} sentences "
+              f"({len(model._rows)} histories)")
+        return model
+
+    def save(self, path):
+        histories = sorted(self._rows, key=self._rows.get)
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, order=np.array(self.order), alphabet=np.array(ALPHABET),
+                                histories=np.array(histories), logprobs=self.logprobs.astype(np.float16))
+        print(f"[CharNgramModel] Saved {len(histories)} histories to {path}")
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"文字n-gramモデルが見つかりません: {path}")
+        with np.load(path) as data:
+            if str(data["alphabet"]) != ALPHABET:
+                raise ValueError(f"文字n-gramモデルの文字集合が現在の設定と一致しません: {path}")
+            return cls(int(data["order"]), data["histories"].tolist(), data["logprobs"])
+
+
+def _normalize(word):
+    """小文字にして、モデルの文字集合に無い文字 (記号・数字など) を取り除く"""
+    return "".join(char for char in word.lower() if char in ALPHABET and char != BOUNDARY)
@@ -0,0 +1,206 @@
+"""
+単語予測のオフライン評価 (ビーム幅・候補数ごとのヒット率)
+
+phrases2.txt (と words.json) の各単語を、単語を最後まで入力したときのキー列で予測させ、
+正解の単語が何位に出るかを集計する。ビーム幅ごとに以下を出力する。
+    hit@k (候補数 k 以内に正解が入った割合) / 平均順位 / MRR / 1語あたりの遅延 p50・p99 / 最大RSS
+
+モデルは親プロセスで1回だけ読み込み、fork したワーカープロセスで共有する
+(バイナリモデルは mmap されるので、ページはプロセス間で共有される)。
+
+使い方:
+    python evaluate_predictor.py
+    python evaluate_predictor.py --widths 1000 10000 100000 --limits 10 20 --workers 8
+    python evaluate_predictor.py --words words.json --with-context --json eval_result.json
+    python evaluate_predictor.py --write-notfound   # word_notfound_limit=*_beamWidth=*.txt を出力
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import statistics
+import sys
+import time
+
+from word_predictor import LOAD_METHODS, WordPredictor
+
+# fork したワーカーから参照する予測器 (親プロセスで読み込む)
+_predictor = None
+_predictor_args = None
+
+
+def load_phrase_items(path):
+    """フレーズファイルの各単語を (単語, 行番号, 同じフレーズ内の直前までの単語) にする"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = re.sub(r'\[source:\s*\d+\]', '', f.read())
+    items = []
+    for line_no, line in enumerate(content.split('\n'), 1):
+        words = [w.lower() for w in line.strip().split()]
+        for i, word in enumerate(words):
+            items.append((word, line_no, words[:i]))
+    return items
+
+
+def load_word_items(path):
+    """words.json の各単語を (単語, 番号, 文脈なし) にする"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    words = data.get('words', []) if isinstance(data, dict) else data
+    return [(w.lower(), i, []) for i, w in enumerate(words, 1) if isinstance(w, str)]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def _init_worker(args):
+    """fork が使えない環境では各ワーカーでモデルを読み込む"""
+    global _predictor
+    if _predictor is None:
+        _predictor = WordPredictor(args["model"], lexicon=args["lexicon"], vocabulary=args["vocabulary"],
+                                   cache_max_bytes=0, load_method=args["load_method"])
+
+
+def _evaluate_chunk(task):
+    """
+    ワーカー側の処理: 単語の塊を1つのビーム幅で予測して順位と遅延を返す
+    :return: ([(単語, 番号, 順位 or None, 遅延ms), ...], 最大RSS[KB])
+    """
+    items, width, max_limit, with_context = task
+    predictor = _predictor
+    results = []
+    for word, label, context_words in items:
+        index_seq = predictor.text_to_sequence(word)
+        context = predictor.extend_context(None, context_words if with_context else [])
+        start = time.perf_counter()
+        candidates = predictor.decode(index_seq, width, context, limit=max_limit)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        rank = None
+        for i, (_, candidate) in enumerate(candidates[:max_limit], 1):
+            if candidate == word:
+                rank = i
+                break
+        results.append((word, label, rank, elapsed_ms))
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def evaluate(items, widths, limits, workers, with_context, chunk_size):
+    max_limit = max(limits)
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    initargs = (_predictor_args,)
+
+    summaries = []
+    for width in widths:
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        tasks = [(chunk, width, max_limit, with_context) for chunk in chunks]
+
+        # ru_maxrss はプロセスが始まってからの最大値なので、ビーム幅ごとに新しいワーカーで計測する
+        # (同じワーカーを使い回すと、前のビーム幅で使ったメモリが後のビーム幅の値に含まれてしまう)
+        with context.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            start = time.perf_counter()
+            rows, max_rss = [], 0
+            for chunk_rows, rss in pool.imap(_evaluate_chunk, tasks):
+                rows.extend(chunk_rows)
+                max_rss = max(max_rss, rss)
+            wall = time.perf_counter() - start
+
+        summaries.append(summarize(rows, width, limits, wall, max_rss))
+    return summaries
+
+
+def summarize(rows, width, limits, wall, max_rss):
+    latencies = [r[3] for r in rows]
+    ranks = [r[2] for r in rows]
+    found = [r for r in ranks if r is not None]
+    summary = {
+        "beam_width": width,
+        "words": len(rows),
+        "hit": {str(k): sum(1 for r in found if r <= k) / len(rows) if rows else 0.0 for k in limits},
+        "mean_rank": statistics.mean(found) if found else None,
+        "mrr": sum(1.0 / r for r in found) / len(rows) if rows else 0.0,
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p99": percentile(latencies, 99),
+        "wall_seconds": wall,
+        "max_rss_mb": max_rss / 1024,
+        "not_found": {str(k): [(w, label) for w, label, r, _ in rows if r is None or r > k] for k in limits},
+    }
+    return summary
+
+
+def print_table(summaries, limits):
+    hit_cols = " ".join(f"{'hit@' + str(k):>8}" for k in limits)
+    print(f"\n{'width':>8} {'words':>6} {hit_cols} {'rank':>6} {'mrr':>6} {'p50ms':>8} {'p99ms':>8} {'rssMB':>8} {'wall_s':>7}")
+    for s in summaries:
+        hits = " ".join(f"{s['hit'][str(k)]:>8.3f}" for k in limits)
+        mean_rank = f"{s['mean_rank']:.2f}" if s['mean_rank'] is not None else "-"
+        print(f"{s['beam_width']:>8} {s['words']:>6} {hits} {mean_rank:>6} {s['mrr']:>6.3f} "
+              f"{s['latency_ms_p50']:>8.2f} {s['latency_ms_p99']:>8.2f} {s['max_rss_mb']:>8.1f} {s['wall_seconds']:>7.1f}")
+
+
+def write_notfound(summaries, limits, output_dir):
+    """既存の word_notfound_limit=*_beamWidth=*.txt と同じ形式で取りこぼした単語を書き出す"""
+    for s in summaries:
+        for k in limits:
+            entries = [f"{{{word}:{label}}}" for word, label in s["not_found"][str(k)]]
+            path = os.path.join(output_dir, f"word_notfound_limit={k}_beamWidth={s['beam_width']}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(str(entries))
+            print(f"Saved: {path}")
+
+
+def main():
+    global _predictor_args
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="wiki_en_token.arpa.bin")
+    parser.add_argument("--lexicon", default=None, help="語彙制約モードで評価する場合の索引/語彙ファイル")
+    parser.add_argument("--vocabulary", default=None, help="モデルの語彙の索引 (.kidx)。ビームサーチをまとめて採点する経路で評価する")
+    parser.add_argument("--load-method", default="populate", choices=list(LOAD_METHODS),
+                        help="KenLM のモデルの読み込み方法 (spawn のワーカーで共有したいときは lazy / populate)")
+    parser.add_argument("--phrases", default="phrases2.txt")
+    parser.add_argument("--words", default=None, help="追加で評価する単語リスト (words.json 形式)")
+    parser.add_argument("--widths", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--with-context", action="store_true", help="フレーズ内の直前の単語を左文脈として使う")
+    parser.add_argument("--json", default=None, help="集計結果をJSONで保存するパス")
+    parser.add_argument("--write-notfound", action="store_true", help="word_notfound_limit=*_beamWidth=*.txt を出力する")
+    parser.add_argument("--output-dir", default=".")
+    args = parser.parse_args()
+
+    items = load_phrase_items(args.phrases) if args.phrases else []
+    if args.words:
+        items += load_word_items(args.words)
+    if not items:
+        print("No words to evaluate.")
+        sys.exit(1)
+    print(f"Evaluating {len(items)} words with {args.workers} workers")
+
+    _predictor_args = {"model": args.model, "lexicon": args.lexicon, "vocabulary": args.vocabulary,
+                       "load_method": args.load_method}
+    if "fork" in multiprocessing.get_all_start_methods():
+        # fork 前に読み込んでおけば、ワーカーはモデルを読み込み直さずに共有できる
+        _init_worker(_predictor_args)
+
+    summaries = evaluate(items, args.widths, sorted(set(args.limits)), args.workers,
+                         args.with_context, args.chunk_size)
+    print_table(summaries, sorted(set(args.limits)))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": summaries}, f, ensure_ascii=False, indent=2)
+        print(f"Saved: {args.json}")
+    if args.write_notfound:
+        write_notfound(summaries, sorted(set(args.limits)), args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
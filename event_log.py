@@ -0,0 +1,414 @@
+import atexit
+import csv
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# 列指向のログ (ArrowEventLog) は pyarrow があるときだけ書く (pip install pyarrow)
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+ARROW_AVAILABLE = pa is not None
+
+# 開いたままにしておくファイル数の上限 (超えたら最初に開いたものから閉じる)
+MAX_OPEN_FILES = 32
+
+_shared_writer = None
+_shared_writer_lock = threading.Lock()
+
+
+def shared_writer():
+    """全ロガー共通の EventLogWriter (最初に呼ばれたときに書き込みスレッドを起動する)"""
+    global _shared_writer
+    if _shared_writer is None:
+        with _shared_writer_lock:
+            if _shared_writer is None:
+                _shared_writer = EventLogWriter()
+    return _shared_writer
+
+
+class EventLogWriter:
+    """
+    ログ (CSV) の書き込みをバックグラウンドスレッドにまとめるライター
+
+    グローブの入力フレームごとにファイルを開いて1行書いて閉じると、リクエストのスレッドが
+    毎回ファイルのオープンとシステムコールを待つことになる。
+    append() は行をメモリ上のバッファに積むだけで返り、書き込みスレッドが
+    batch_rows 行たまるか flush_interval 秒経つごとに、開いたままのファイルへまとめて書き込む。
+
+    - flush(fsync=True) : それまでに積んだ行を書き込み、ディスクに同期する (試行の区切りで呼ぶ)
+    - close()           : 残りを書き込んでファイルを閉じる (プロセス終了時に atexit から自動で呼ばれる)
+
+    バッファは capacity 行で頭打ちにし、いっぱいのときは書き込みが追いつくまで append() を待たせる。
+    実験データなので、古い行を上書きして捨てることはしない。
+    """
+
+    def __init__(self, capacity=65536, batch_rows=1024, flush_interval=0.25):
+        """
+        :param capacity: バッファに積める最大行数
+        :param batch_rows: この行数たまったらすぐに書き込む
+        :param flush_interval: 行が少なくても、この秒数経ったら書き込む
+        """
+        self.capacity = capacity
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        # (ファイルパス, 行のリスト) の列
+        self._buffer = deque()
+        self._pending_rows = 0
+        # flush() の待ち合わせ: (fsync するか, threading.Event)
+        self._flush_requests = []
+        self._closing = False
+        self._cond = threading.Condition()
+        # ファイルパス -> 開いたままのファイル (書き込みスレッドだけが触る)
+        self._files = {}
+        self.rows_written = 0
+        self.batches_written = 0
+        self._thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, path, rows):
+        """
+        行のリストを path の末尾に追加する (書き込みは後で行う)
+        :param path: CSV のファイルパス (行は値のリスト)、または ArrowEventLog (行は ArrowEventLog.write 参照)
+        """
+        if not rows:
+            return
+        with self._cond:
+            closing = self._closing
+            while not closing and self._pending_rows >= self.capacity:
+                self._cond.notify_all()
+                self._cond.wait()
+            if not closing:
+                self._buffer.append((path, rows))
+                self._pending_rows += len(rows)
+                # 空のバッファに積んだときも起こして、flush_interval の期限を数え始めさせる
+                if self._pending_rows >= self.batch_rows or len(self._buffer) == 1:
+                    self._cond.notify_all()
+                return
+        # 終了処理の後に来た行は、書き込みスレッドが残りを書き終えてから、その場で書き込む
+        self._thread.join()
+        handle = _open(path)
+        handle.write(rows)
+        handle.close()
+
+    def flush(self, fsync=False, wait=True, timeout=None):
+        """
+        それまでに append() した行をすぐに書き込む
+        :param fsync: ディスクへの同期 (os.fsync) も行う
+        :param wait: 書き込み (と同期) が終わるまで待つ
+        :return: 時間内に終わったかどうか (待たない場合は False)
+        """
+        done = threading.Event()
+        with self._cond:
+            if self._closing:
+                # 終了処理で全て書き込まれる
+                closing = True
+            else:
+                closing = False
+                self._flush_requests.append((fsync, done))
+            self._cond.notify_all()
+        if not wait:
+            return False
+        if closing:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return done.wait(timeout)
+
+    def close(self):
+        """残りの行を書き込み、ディスクに同期してファイルを閉じる"""
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = None
+                while not (self._closing or self._flush_requests or self._pending_rows >= self.batch_rows):
+                    if self._buffer and deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                batch, self._buffer = self._buffer, deque()
+                self._pending_rows = 0
+                requests, self._flush_requests = self._flush_requests, []
+                closing = self._closing
+                # バッファが空いたので、待っている append() を再開させる
+                self._cond.notify_all()
+
+            self._write(batch, fsync=closing or any(fsync for fsync, _ in requests))
+            for _, done in requests:
+                done.set()
+            if closing:
+                for handle in self._files.values():
+                    handle.close()
+                self._files.clear()
+                return
+
+    def _write(self, batch, fsync):
+        # ファイルごとにまとめてから書き込む (ArrowEventLog は1回の書き込みが1レコードバッチになる)
+        grouped = {}
+        for path, rows in batch:
+            grouped.setdefault(path, []).extend(rows)
+        touched = {}
+        for path, rows in grouped.items():
+            try:
+                handle = self._files.get(path)
+                if handle is None:
+                    if len(self._files) >= MAX_OPEN_FILES:
+                        oldest = next(iter(self._files))
+                        self._files.pop(oldest).close()
+                        touched.pop(oldest, None)
+                    handle = self._files[path] = _open(path)
+                handle.write(rows)
+                touched[path] = handle
+                self.rows_written += len(rows)
+            except Exception as e:
+                print(f"Log Error: {e}", flush=True)
+        if batch:
+            self.batches_written += 1
+        for handle in (self._files.values() if fsync else touched.values()):
+            try:
+                handle.flush()
+                if fsync:
+                    handle.sync()
+            except Exception as e:
+                print(f"Log Error: {e}", flush=True)
+
+    def stats(self):
+        return {"pending_rows": self._pending_rows, "open_files": len(self._files),
+                "rows_written": self.rows_written, "batches_written": self.batches_written}
+
+
+def _open(path):
+    return _CsvFile(path) if isinstance(path, str) else path
+
+
+class _CsvFile:
+    """EventLogWriter が開いたままにしておく CSV ファイル"""
+
+    def __init__(self, path):
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+
+    def write(self, rows):
+        csv.writer(self._file).writerows(rows)
+
+    def flush(self):
+        self._file.flush()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowEventLog:
+    """
+    列指向のバイナリ形式 (Arrow IPC ストリーム) のログファイル
+
+    CSV と同じ列を型付きで保存し、さらにイベントのデータ (EventData) のキーを
+    "Data.<キー>" の列に展開する (辞書でないデータは "Data" 列)。解析側は文字列をパースせずに
+    read_event_log() で DataFrame として読み込める。EventData 列にも元のデータを JSON で残す。
+
+    展開した列の型は最初に出てきた値で決める (数値は float64、真偽値は bool、それ以外は文字列)。
+    型の合わない値はその列では null になる (EventData には残る)。
+    新しいキーが出てきたら、列を増やしたストリームを同じファイルに続けて書く。
+    EventLogWriter の書き込みスレッドから使うもので、append() するたびにレコードバッチが1つ増える。
+    """
+    SUFFIX = ".arrow"
+    PAYLOAD_COLUMN = "EventData"
+    PAYLOAD_PREFIX = "Data"
+
+    def __init__(self, path, columns):
+        """
+        :param columns: (列名, 型) のリスト。型は "string" / "int64" / "float64" / "timestamp" (ISO 8601 の文字列)
+        """
+        if pa is None:
+            raise ImportError("ArrowEventLog には pyarrow が必要です (pip install pyarrow)")
+        self.path = path
+        self.columns = list(columns)
+        self._fixed_fields = [pa.field(name, _arrow_type(kind)) for name, kind in self.columns]
+        # 展開した列の名前 -> 型
+        self._payload_types = {}
+        self._schema = None
+        self._stream = None
+        # ファイル・ストリームの作成と pyarrow の初期化は、最初の書き込みを待たずにここで済ませておく。
+        # pyarrow は最初の pa.array() で pandas を import し、その中で atexit が登録されるので、
+        # 最初の書き込みが終了時の書き出し (atexit) になると "can't register atexit after shutdown" で失敗し、行が失われる
+        self._file = open(path, 'ab')
+        self._open_stream()
+        pa.record_batch([pa.array([], type=field.type) for field in self._fixed_fields], schema=self._schema)
+
+    def _open_stream(self):
+        """今の列 (固定の列 + これまでに出てきたキーの列) でストリームを始める"""
+        self._schema = pa.schema(self._fixed_fields + [
+            pa.field(name, kind) for name, kind in self._payload_types.items()])
+        self._stream = pa.ipc.new_stream(self._file, self._schema)
+
+    def write(self, rows):
+        """
+        :param rows: (値のリスト, イベントのデータ) のリスト。値は columns の順 (EventData 列の値はデータから作る)
+        """
+        payloads = [flatten_payload(payload, self.PAYLOAD_PREFIX) for _, payload in rows]
+        new_fields = False
+        for payload in payloads:
+            for name, value in payload.items():
+                if name not in self._payload_types and value is not None:
+                    self._payload_types[name] = _value_type(value)
+                    new_fields = True
+        if self._file is None:
+            # EventLogWriter が閉じたあと (開いているファイル数の上限・終了処理の後の書き込み) は開き直して続きに書く
+            self._file = open(self.path, 'ab')
+            self._open_stream()
+        elif new_fields:
+            # スキーマが変わるので、今のストリームを閉じて次のストリームを始める
+            self._stream.close()
+            self._open_stream()
+
+        arrays = []
+        for i, (name, kind) in enumerate(self.columns):
+            if name == self.PAYLOAD_COLUMN:
+                values = [_payload_text(payload) for _, payload in rows]
+            else:
+                values = [_coerce(values[i], kind) for values, _ in rows]
+            arrays.append(pa.array(values, type=self._fixed_fields[i].type))
+        for name, kind in self._payload_types.items():
+            arrays.append(pa.array([_fit(payload.get(name), kind) for payload in payloads], type=kind))
+        self._stream.write_batch(pa.record_batch(arrays, schema=self._schema))
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_event_log(path):
+    """
+    ArrowEventLog のファイルを pandas の DataFrame として読み込む
+    途中で列が増えたストリームは、列を揃えて (無い値は null) つなげる。
+    書き込み途中で終了したファイルも、読めたところまでを返す。
+    """
+    if pa is None:
+        raise ImportError("Arrow 形式のログの読み込みには pyarrow が必要です (pip install pyarrow)")
+    tables = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while f.tell() < size:
+            batches = []
+            try:
+                reader = pa.ipc.open_stream(f)
+                for batch in reader:
+                    batches.append(batch)
+            except (pa.ArrowInvalid, OSError):
+                # 末尾が書きかけ
+                if batches:
+                    tables.append(pa.Table.from_batches(batches))
+                break
+            tables.append(pa.Table.from_batches(batches, schema=reader.schema))
+    if not tables:
+        raise ValueError(f"Arrow 形式のログが空です: {path}")
+    import pandas as pd
+    # 整数の列は null があっても float にしない
+    return pa.concat_tables(tables, promote_options="default").to_pandas(
+        types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+def read_raw_log(csv_path, parse_event_data):
+    """
+    Rawログ (_raw.csv) を DataFrame として読み込む (解析スクリプト用)
+    同じ名前の _raw.arrow があり pyarrow が使えればそちらを読む (EventData は Data.<キー> の列に展開済み)。
+    CSV しか無い古いログは、parse_event_data で EventData を1行ずつパースして同じ列を作る。
+    """
+    import pandas as pd
+    arrow_path = os.path.splitext(csv_path)[0] + ArrowEventLog.SUFFIX
+    if pa is not None and os.path.exists(arrow_path):
+        return read_event_log(arrow_path)
+    df = pd.read_csv(csv_path)
+    if ArrowEventLog.PAYLOAD_COLUMN in df.columns:
+        flat = pd.DataFrame([flatten_payload(parse_event_data(value), ArrowEventLog.PAYLOAD_PREFIX)
+                             for value in df[ArrowEventLog.PAYLOAD_COLUMN]], index=df.index)
+        df = df.join(flat)
+    return df
+
+
+def flatten_payload(payload, prefix="Data"):
+    """イベントのデータを {"Data.<キー>": 値} にする (辞書でないデータは {"Data": 値})"""
+    if isinstance(payload, dict):
+        return {f"{prefix}.{key}": value for key, value in payload.items()}
+    if payload is None or payload == "":
+        return {}
+    return {prefix: payload}
+
+
+def _arrow_type(kind):
+    if kind == "timestamp":
+        # ログの時刻は JST (+09:00) の ISO 8601
+        return pa.timestamp("us", tz="+09:00")
+    if kind in ("string", "int64", "float64"):
+        return pa.type_for_alias(kind)
+    raise ValueError(f"未知の列の型です: {kind}")
+
+
+def _value_type(value):
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, (int, float)):
+        return pa.float64()
+    return pa.string()
+
+
+def _fit(value, kind):
+    """展開した列の型に値を合わせる (合わなければ None)"""
+    if value is None:
+        return None
+    if kind == pa.bool_():
+        return value if isinstance(value, bool) else None
+    if kind == pa.float64():
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def _payload_text(payload):
+    if payload is None:
+        return None
+    return payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+
+
+def _coerce(value, kind):
+    """固定の列の値を型に合わせる ("None" や空文字など変換できない値は null)"""
+    if value is None:
+        return None
+    if kind == "string":
+        return str(value)
+    try:
+        if kind == "int64":
+            return int(value)
+        if kind == "float64":
+            return float(value)
+        if kind == "timestamp":
+            return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    raise ValueError(f"未知の列の型です: {kind}")
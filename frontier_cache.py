@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+
+# 仮説1件あたりのおおよそのメモリ量 [byte] (word_predictor.Beam)
+# str(49) + リストのポインタ(8) + スコア(float64, 8) + 余裕分。単語の文字数は別途加算する
+HYPOTHESIS_BYTES = 72
+
+
+class _TrieNode:
+    __slots__ = ("children", "frontier", "nbytes")
+
+    def __init__(self):
+        self.children = {}
+        self.frontier = None
+        self.nbytes = 0
+
+
+class FrontierCache:
+    """
+    ビームサーチの途中経過 (各ステップ後のビーム = フロンティア) を
+    インデックス列のプレフィックスをキーにしたトライ木で保持するキャッシュ。
+
+    次のキー入力やバックスペースでは、最も長く一致するプレフィックスの
+    フロンティアから探索を再開できるので、単語が長くなってもキー1打あたりの
+    計算量はほぼ一定になる。
+    容量は max_bytes (概算) で制限し、超えたら最後に使われた時刻が古いものから捨てる (LRU)。
+
+    フロンティア (len() で仮説数が分かるもの) は共有されるので、呼び出し側で書き換えないこと。
+    キャッシュはセッションごとに持つので、ロックは同じセッションへの
+    リクエストが重なったときにしか競合しない。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # 名前空間 (ビーム幅など、結果が変わる設定) ごとのトライ木の根
+        self._roots = {}
+        # (namespace, index_seq) -> _TrieNode  (末尾が最近使われたもの)
+        self._lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lru)
+
+    def lookup(self, namespace, index_seq):
+        """
+        index_seq のプレフィックスのうち、キャッシュ済みで最も長いものを探す
+        :return: (一致した長さ, フロンティア)。何も無ければ (0, None)
+        """
+        with self._lock:
+            return self._lookup(namespace, index_seq)
+
+    def _lookup(self, namespace, index_seq):
+        node = self._roots.get(namespace)
+        best_len, best_node = 0, None
+        if node is not None:
+            for depth, i_char in enumerate(index_seq, 1):
+                node = node.children.get(i_char)
+                if node is None:
+                    break
+                if node.frontier is not None:
+                    best_len, best_node = depth, node
+
+        if best_node is None:
+            self.misses += 1
+            return 0, None
+
+        self.hits += 1
+        self._lru.move_to_end((namespace, index_seq[:best_len]))
+        return best_len, best_node.frontier
+
+    def store(self, namespace, index_seq, frontier):
+        """index_seq まで処理し終えたビームを登録する"""
+        if not index_seq or self.max_bytes <= 0:
+            return
+
+        nbytes = len(frontier) * (HYPOTHESIS_BYTES + len(index_seq))
+        if nbytes > self.max_bytes:
+            # 1件で上限を超えるものはキャッシュしない
+            return
+
+        with self._lock:
+            self._store(namespace, index_seq, frontier, nbytes)
+
+    def _store(self, namespace, index_seq, frontier, nbytes):
+        node = self._roots.setdefault(namespace, _TrieNode())
+        for i_char in index_seq:
+            node = node.children.setdefault(i_char, _TrieNode())
+
+        key = (namespace, index_seq)
+        if node.frontier is not None:
+            self.total_bytes -= node.nbytes
+        node.frontier = frontier
+        node.nbytes = nbytes
+        self.total_bytes += nbytes
+        self._lru[key] = node
+        self._lru.move_to_end(key)
+
+        while self.total_bytes > self.max_bytes and self._lru:
+            self._evict_oldest()
+
+    def clear(self):
+        with self._lock:
+            self._roots.clear()
+            self._lru.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._lru),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _evict_oldest(self):
+        (namespace, index_seq), node = self._lru.popitem(last=False)
+        self.total_bytes -= node.nbytes
+        node.frontier = None
+        node.nbytes = 0
+        self._prune(namespace, index_seq)
+
+    def _prune(self, namespace, index_seq):
+        """フロンティアも子も持たなくなった枝をトライ木から取り除く"""
+        root = self._roots.get(namespace)
+        if root is None:
+            return
+        path = [root]
+        for i_char in index_seq:
+            child = path[-1].children.get(i_char)
+            if child is None:
+                return
+            path.append(child)
+
+        for depth in range(len(index_seq), 0, -1):
+            node = path[depth]
+            if node.frontier is not None or node.children:
+                break
+            del path[depth - 1].children[index_seq[depth - 1]]
+
+        if not root.children:
+            del self._roots[namespace]
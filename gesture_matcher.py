@@ -0,0 +1,136 @@
+FINGERS = ("T", "I", "M", "R", "P")
+# 入力に無い (または未知の値の) 指の状態。どのジェスチャーの条件にも含まれない
+UNKNOWN = None
+
+
+def normalize_state(value):
+    """指の状態の表記をそろえる (" open" -> "OPEN")。文字列以外はそのまま返す"""
+    return value.strip().upper() if isinstance(value, str) else value
+
+
+class GestureMatcher:
+    """
+    ジェスチャーの定義を読み込み時にビットマスクに変換しておき、入力を整数1つで判定するマッチャー
+
+    (指, 状態) の組ごとに1ビットを割り当てる。入力フレームは各指の状態のビットを1つずつ立てた整数になり
+    (入力に無い指・未知の状態は、その指の UNKNOWN のビットを立てる)、
+    ジェスチャーは「条件のある指で許されていない (指, 状態) のビット」を集めた forbidden マスクになる。
+        マッチする <=> frame & forbidden == 0
+    なので、判定は AND 1回で済む。条件の無い指はどの状態でもよい。
+
+    入力フレームごとの「どのジェスチャーか」(classify) は、フレームの整数をキーに結果を覚えておくので、
+    同じ姿勢が続く間は dict を1回引くだけになる (フレームの種類は (状態数+1)^5 通りしかない)。
+    """
+
+    def __init__(self, gestures, extra_states=()):
+        """
+        :param gestures: ジェスチャーの定義のリスト ({"ID", "GestureName", "State": {指: 状態 or 状態のリスト}})
+                         "State" が無ければ定義そのものを指 -> 状態として読む
+        :param extra_states: ジェスチャーの定義に無くても compile() の条件に使う状態
+        """
+        states = {UNKNOWN} | {normalize_state(state) for state in extra_states}
+        patterns = []
+        for gesture in gestures:
+            pattern = self._pattern(gesture.get('State') or gesture)
+            patterns.append((gesture['ID'], pattern))
+            for allowed in pattern.values():
+                states.update(allowed)
+
+        # 指ごとに「状態 -> ビット」の表を作る (UNKNOWN も含めて、各指で状態数分のビットを使う)
+        names = [UNKNOWN] + sorted(s for s in states if s is not UNKNOWN)
+        self._bits = {}
+        for f, finger in enumerate(FINGERS):
+            self._bits[finger] = {state: 1 << (f * len(names) + i) for i, state in enumerate(names)}
+
+        self.gestures = {gesture['ID']: gesture for gesture in gestures}
+        self._forbidden = {gesture_id: self.compile(pattern) for gesture_id, pattern in patterns}
+        # classify の候補の順序: 許す入力の種類が少ない (条件が厳しい) ジェスチャーから
+        self._order = sorted(
+            self._forbidden, key=lambda gesture_id: self._allowed_count(self._forbidden[gesture_id]))
+        self._classified = {}
+
+    def __len__(self):
+        return len(self.gestures)
+
+    def __contains__(self, gesture_id):
+        return gesture_id in self.gestures
+
+    @staticmethod
+    def _pattern(states):
+        """指 -> 許す状態の集合 (条件の無い指は含めない)"""
+        pattern = {}
+        for finger in FINGERS:
+            allowed = states.get(finger)
+            if allowed is None:
+                continue
+            if not isinstance(allowed, list):
+                allowed = [allowed]
+            pattern[finger] = {normalize_state(str(state)) for state in allowed}
+        return pattern
+
+    def compile(self, states):
+        """
+        指 -> 状態 (または状態のリスト・集合) の条件を forbidden マスクにする
+        状態はジェスチャーの定義か extra_states にあるものに限る
+        (それ以外の状態は入力では UNKNOWN になるので、条件に書いてもマッチしない)。
+        """
+        forbidden = 0
+        for finger, allowed in states.items():
+            if allowed is None:
+                continue
+            if isinstance(allowed, str) or not hasattr(allowed, '__iter__'):
+                allowed = [allowed]
+            allowed = {normalize_state(str(state)) for state in allowed}
+            for state, bit in self._bits[finger].items():
+                if state not in allowed:
+                    forbidden |= bit
+        return forbidden
+
+    def _allowed_count(self, forbidden):
+        count = 1
+        for bits in self._bits.values():
+            count *= sum(1 for bit in bits.values() if not bit & forbidden)
+        return count
+
+    # =========================================================
+    #  判定
+    # =========================================================
+
+    def encode(self, input_data):
+        """入力 (指 -> 状態) をフレームの整数にする"""
+        frame = 0
+        for finger in FINGERS:
+            bits = self._bits[finger]
+            state = input_data.get(finger)
+            # ほとんどの入力は表記がそろっているので、そのまま引けなかったときだけそろえ直す
+            # 文字列以外 (リスト・dict など、ハッシュできない値もある) は未知の状態として扱う
+            if not isinstance(state, str):
+                bit = bits[UNKNOWN]
+            else:
+                bit = bits.get(state)
+                if bit is None:
+                    bit = bits.get(normalize_state(state), bits[UNKNOWN])
+            frame |= bit
+        return frame
+
+    def matches(self, frame, forbidden):
+        """フレームが compile() したマスクの条件を満たすか"""
+        return not frame & forbidden
+
+    def match(self, frame, gesture_id):
+        """
+        フレームがジェスチャーにマッチするか
+        :raises KeyError: 読み込んでいない ID
+        """
+        return not frame & self._forbidden[gesture_id]
+
+    def classify(self, frame):
+        """
+        フレームにマッチする全てのジェスチャーの ID (条件が厳しいものから)
+        先頭が「どのジェスチャーか」の最有力候補になる。無ければ空のタプル
+        """
+        result = self._classified.get(frame)
+        if result is None:
+            result = tuple(gesture_id for gesture_id in self._order if not frame & self._forbidden[gesture_id])
+            self._classified[frame] = result
+        return result
@@ -3,8 +3,13 @@ import os
 import time
 import csv
 import random
+import threading
+from functools import wraps
 from datetime import datetime,timedelta,timezone
 
+from event_log import ARROW_AVAILABLE, ArrowEventLog, shared_writer
+from gesture_matcher import FINGERS, GestureMatcher
+
 # 状態定義
 STATE_IDLE = "IDLE"
 STATE_WAIT_HAND_OPEN = "WAIT_HAND_OPEN" # HandOpen待機中
@@ -13,11 +18,25 @@ STATE_MEASURING = "MEASURING"           # ジェスチャー計測中
 STATE_COMPLETED = "COMPLETED"           # 全試行完了
 
 # 定数
+COUNTDOWN_DURATION = 3.0 # 秒
 DWELL_TIME_THRESHOLD = 0.5 # 秒
 MATCH_DISPLAY_DURATION = 0.5 # 秒（MATCH表示を見せる時間）
 
+# 計測開始の合図 (全ての指を開く) の指の状態
+HAND_OPEN_STATE = "OPEN"
+
 jst = timezone(timedelta(hours=9))
 
+def _locked(method):
+    """GestureTest のメソッドをロックを取って実行する (入力・状態の取得・ストリームが別スレッドから同時に来るため)"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._changed:
+            result = method(self, *args, **kwargs)
+            self._publish()
+            return result
+    return wrapper
+
 class Logger:
     def __init__(self, participant_id, condition, handedness="R"):
         self.participant_id = participant_id
@@ -35,6 +54,9 @@ class Logger:
         if not os.path.exists(self.log_dir):
             os.makedirs(self.log_dir)
 
+        # 書き込みはバックグラウンドのスレッドがまとめて行う (リクエストのスレッドではファイルを開かない)
+        self.writer = shared_writer()
+
         now_str = datetime.now(jst).strftime("%Y-%m-%d-%H-%M-%S")
         self.log_filepath = os.path.join(self.log_dir, f"log_{participant_id}_{now_str}_gesture_raw.csv")
         
@@ -52,6 +74,16 @@ class Logger:
         except Exception as e:
             print(f"Logger Init Error: {e}", flush=True)
 
+        # 解析用に同じ内容を列指向の形式 (_raw.arrow) でも保存する (pyarrow がある場合)
+        self.columnar = None
+        if ARROW_AVAILABLE:
+            self.columnar = ArrowEventLog(self.log_filepath[:-len(".csv")] + ArrowEventLog.SUFFIX, [
+                ("ServerTimestampISO", "timestamp"), ("ServerTimestamp", "int64"), ("ParticipantID", "string"),
+                ("Condition", "string"), ("Handedness", "string"), ("TrialID", "int64"),
+                ("TargetGesture", "string"), ("TargetID", "int64"),
+                ("EventType", "string"), ("EventData", "string"), ("ClientTimestamp", "int64")
+            ])
+
     def log_raw(self, trial_id, target_name, target_id, events):
         now = time.time()
         server_ts_iso = datetime.fromtimestamp(now,jst).isoformat()
@@ -64,50 +96,58 @@ class Logger:
                 return
 
         try:
-            with open(self.log_filepath, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                for event in events:
-                    if isinstance(event, str):
-                        try:
-                            event = json.loads(event)
-                        except:
-                            continue
-                    
-                    if not isinstance(event, dict):
+            rows = []
+            payloads = []
+            for event in events:
+                if isinstance(event, str):
+                    try:
+                        event = json.loads(event)
+                    except:
                         continue
-
-                    raw_data = event.get('data', {})
-                    if isinstance(raw_data, str):
-                        try:
-                            stripped = raw_data.strip()
-                            if stripped.startswith('{') or stripped.startswith('['):
-                                raw_data = json.loads(raw_data)
-                        except:
-                            pass
-                    
-                    event_data_str = json.dumps(raw_data, ensure_ascii=False)
-                    
-                    row = [
-                        server_ts_iso,
-                        server_ts_ms,
-                        self.participant_id,
-                        self.condition,
-                        self.handedness,
-                        trial_id,
-                        target_name,
-                        target_id,
-                        event.get('type', 'unknown'),
-                        event_data_str,
-                        event.get('timestamp', '') 
-                    ]
-                    writer.writerow(row)
+                
+                if not isinstance(event, dict):
+                    continue
+
+                raw_data = event.get('data', {})
+                if isinstance(raw_data, str):
+                    try:
+                        stripped = raw_data.strip()
+                        if stripped.startswith('{') or stripped.startswith('['):
+                            raw_data = json.loads(raw_data)
+                    except:
+                        pass
+                
+                event_data_str = json.dumps(raw_data, ensure_ascii=False)
+                
+                rows.append([
+                    server_ts_iso,
+                    server_ts_ms,
+                    self.participant_id,
+                    self.condition,
+                    self.handedness,
+                    trial_id,
+                    target_name,
+                    target_id,
+                    event.get('type', 'unknown'),
+                    event_data_str,
+                    event.get('timestamp', '') 
+                ])
+                payloads.append(raw_data)
+            self.writer.append(self.log_filepath, rows)
+            if self.columnar is not None:
+                self.writer.append(self.columnar, list(zip(rows, payloads)))
         except Exception as e:
             print(f"Log Error: {e}", flush=True)
 
+    def sync(self):
+        """ここまでのログをディスクに書き込む (試行の区切りで呼ぶ)"""
+        # 同期は書き込みスレッドに任せて待たない (状態の遷移を fsync で遅らせない)
+        self.writer.flush(fsync=True, wait=False)
+
 class GestureTest:
     def __init__(self, gestures_file):
         self.gestures_file = gestures_file
-        self.gestures = self._load_gestures()
+        self._set_gestures(self._load_gestures())
         
         self.participant_id = None
         self.condition = None
@@ -120,6 +160,7 @@ class GestureTest:
         self.state = STATE_IDLE
         self.logger = None
         
+        # 時刻はすべて time.monotonic() の値 (ログには _epoch_ms で実時刻に直して書く)
         self.countdown_start_time = None
         self.measure_start_time = None
         
@@ -128,6 +169,28 @@ class GestureTest:
         self.match_commit_time = None     # マッチが確定した時刻
         
         self.current_input = {} 
+        # current_input を GestureMatcher.encode() した整数 (判定はこれで行う)
+        self.current_frame = self.matcher.encode(self.current_input)
+
+        # 状態の変化の通知 (/gesture/stream 用)
+        # 状態・試行・入力・マッチの有無など、画面に出るものが変わるたびに version を上げる
+        self._changed = threading.Condition(threading.RLock())
+        self.version = 0
+        self.changed_at = time.monotonic()
+        self._published_key = None
+
+        # 時間経過による遷移 (カウントダウン終了・維持時間の達成・MATCH表示の終了) のタイマー
+        # 遷移は常に1つしか予約されないので、期限とコールバックを1組だけ持つ
+        self._timer_deadline = None
+        self._timer_callback = None
+        self._timer_thread = threading.Thread(target=self._run_timer, name="gesture-timer", daemon=True)
+        self._timer_thread.start()
+
+    def _set_gestures(self, gestures):
+        """ジェスチャーの定義を設定して、判定用のビットマスクに変換しておく"""
+        self.gestures = gestures
+        self.matcher = GestureMatcher(gestures, extra_states=[HAND_OPEN_STATE])
+        self._hand_open_mask = self.matcher.compile({finger: HAND_OPEN_STATE for finger in FINGERS})
 
     def _load_gestures(self):
         abs_path = os.path.abspath(self.gestures_file)
@@ -167,8 +230,9 @@ class GestureTest:
     def target_gesture(self):
         if self.current_gesture_id is None:
             return None
-        return next((g for g in self.gestures if g.get('ID') == self.current_gesture_id), None)
+        return self.matcher.gestures.get(self.current_gesture_id)
 
+    @_locked
     def configure_test(self, participant_id, condition, max_trials, handedness="R"):
         self.participant_id = participant_id
         self.condition = condition
@@ -177,7 +241,7 @@ class GestureTest:
         self.logger = Logger(participant_id, condition, handedness)
         
         if not self.gestures:
-            self.gestures = self._load_gestures()
+            self._set_gestures(self._load_gestures())
             if not self.gestures:
                 self.trials = []
                 return
@@ -218,7 +282,9 @@ class GestureTest:
         self.measure_start_time = None
         self.match_hold_start_time = None
         self.match_commit_time = None
+        self._cancel_timer()
 
+    @_locked
     def update_input(self, data):
         """外部からの入力データ更新"""
         if self.state == STATE_IDLE:
@@ -237,6 +303,7 @@ class GestureTest:
                     normalized_data[k] = v
 
             self.current_input.update(normalized_data)
+            self.current_frame = self.matcher.encode(self.current_input)
 
             if self.logger:
                 current_trial = self.completed_trials + 1
@@ -257,162 +324,105 @@ class GestureTest:
             print(f"Error in update_input: {e}", flush=True)
 
     def _update_state_logic(self):
+        """入力による遷移 (時間経過による遷移はタイマーが期限ちょうどに行う)"""
         try:
+            now = time.monotonic()
             if self.state == STATE_WAIT_HAND_OPEN:
-                if self._is_hand_open(self.current_input):
+                if self.matcher.matches(self.current_frame, self._hand_open_mask):
                     print(f"[GestureTest] Hand OPEN detected. Moving to COUNTDOWN.", flush=True)
                     self.state = STATE_COUNTDOWN
-                    self.countdown_start_time = time.time()
-                    
-                    if self.logger:
-                        self.logger.log_raw(self.completed_trials + 1, 
-                                            self.target_gesture['GestureName'], 
-                                            self.target_gesture['ID'], 
-                                            [{
-                                                "type": "state_change", 
-                                                "data": {"from": STATE_WAIT_HAND_OPEN, "to": STATE_COUNTDOWN},
-                                                "timestamp": int(time.time() * 1000)
-                                            }])
-
-            elif self.state == STATE_COUNTDOWN:
-                if time.time() - self.countdown_start_time >= 3.0:
-                    print(f"[GestureTest] Countdown finished. Waiting for Client Render Trigger...", flush=True)
-                    self.state = STATE_MEASURING
-                    self.measure_start_time = None 
-                    self.match_hold_start_time = None
-                    
-                    if self.logger:
-                        self.logger.log_raw(self.completed_trials + 1, 
-                                            self.target_gesture['GestureName'], 
-                                            self.target_gesture['ID'], 
-                                            [{
-                                                "type": "state_change", 
-                                                "data": {"from": STATE_COUNTDOWN, "to": STATE_MEASURING},
-                                                "timestamp": int(time.time() * 1000)
-                                            }])
+                    self.countdown_start_time = now
+                    self._log_state_change(STATE_WAIT_HAND_OPEN, STATE_COUNTDOWN, now)
+                    self._schedule(now + COUNTDOWN_DURATION, self._finish_countdown)
                 
             elif self.state == STATE_MEASURING:
-                if self.measure_start_time is None:
-                    return
-
-                # マッチ確定後の表示期間処理
-                if self.match_commit_time is not None:
-                    if time.time() - self.match_commit_time >= MATCH_DISPLAY_DURATION:
-                         self._process_match()
+                # 計測開始前・マッチ確定後の表示期間中は入力を判定しない
+                if self.measure_start_time is None or self.match_commit_time is not None:
                     return
 
-                target = self.target_gesture
-                is_matching = self._check_match(target, self.current_input)
+                is_matching = (self.current_gesture_id in self.matcher
+                               and self.matcher.match(self.current_frame, self.current_gesture_id))
                 
                 if is_matching:
                     if self.match_hold_start_time is None:
-                        # マッチ開始！維持計測スタート
-                        self.match_hold_start_time = time.time()
-                    
-                    # 0.5秒維持できたかチェック
-                    elapsed = time.time() - self.match_hold_start_time
-                    if elapsed >= DWELL_TIME_THRESHOLD:
-                        # 即座に遷移せず、確定時刻を記録して待機に入る
-                        self.match_commit_time = time.time()
-                        print(f"[GestureTest] Match Committed (Wait for display).", flush=True)
+                        # マッチ開始！維持できたらタイマーで確定する
+                        self.match_hold_start_time = now
+                        self._schedule(now + DWELL_TIME_THRESHOLD, self._commit_match)
                 else:
                     # マッチが途切れたらリセット
+                    if self.match_hold_start_time is not None:
+                        self._cancel_timer()
                     self.match_hold_start_time = None
 
         except Exception as e:
             print(f"Error in _update_state_logic: {e}", flush=True)
 
-    def _is_hand_open(self, input_data):
-        fingers = ['T', 'I', 'M', 'R', 'P']
-        for finger in fingers:
-            val = input_data.get(finger)
-            if isinstance(val, str):
-                val = val.strip().upper()
-            if val != 'OPEN':
-                return False
-        return True
-
-    def _check_match(self, target, input_data):
-        if not target: return False
-        
-        target_states = target.get('State', {})
-        if not target_states: target_states = target
+    def _finish_countdown(self, at):
+        """タイマー: カウントダウン終了 (at = 終了予定時刻)"""
+        if self.state != STATE_COUNTDOWN:
+            return
+        print(f"[GestureTest] Countdown finished. Waiting for Client Render Trigger...", flush=True)
+        self.state = STATE_MEASURING
+        self.measure_start_time = None 
+        self.match_hold_start_time = None
+        self._log_state_change(STATE_COUNTDOWN, STATE_MEASURING, at)
 
-        for finger in ['T', 'I', 'M', 'R', 'P']:
-            target_val_or_list = target_states.get(finger)
-            input_val = input_data.get(finger)
-            
-            if isinstance(input_val, str):
-                input_val = input_val.strip().upper()
-            
-            if target_val_or_list is None:
-                continue
+    def _commit_match(self, at):
+        """タイマー: 維持時間の達成 (確定後、MATCH表示を見せてから次へ進む)"""
+        if self.state != STATE_MEASURING or self.match_hold_start_time is None:
+            return
+        self.match_commit_time = at
+        print(f"[GestureTest] Match Committed (Wait for display).", flush=True)
+        self._schedule(at + MATCH_DISPLAY_DURATION, self._finish_match_display)
 
-            if isinstance(target_val_or_list, list):
-                if input_val not in target_val_or_list:
-                    return False
-            else:
-                t_str = str(target_val_or_list).strip().upper()
-                if t_str != input_val:
-                    return False
-        return True
+    def _finish_match_display(self, at):
+        """タイマー: MATCH表示の終了"""
+        if self.state != STATE_MEASURING or self.match_commit_time is None:
+            return
+        self._process_match(at)
 
-    def _process_match(self):
-        # 反応時間 (RT) の計算
+    def _log_state_change(self, from_state, to_state, at, **data):
+        if self.logger:
+            tg = self.target_gesture
+            self.logger.log_raw(self.completed_trials + 1, 
+                                tg['GestureName'] if tg else "None", 
+                                tg['ID'] if tg else -1, 
+                                [{
+                                    "type": "state_change", 
+                                    "data": {"from": from_state, "to": to_state, **data},
+                                    "timestamp": _epoch_ms(at)
+                                }])
+
+    def _process_match(self, at):
+        # 反応時間 (RT) の計算: 計測開始からマッチし始める (その後維持できた) までの時間
         if self.match_hold_start_time:
              rt_end_time = self.match_hold_start_time
         else:
-             rt_end_time = self.match_commit_time - DWELL_TIME_THRESHOLD if self.match_commit_time else time.time()
+             rt_end_time = self.match_commit_time - DWELL_TIME_THRESHOLD if self.match_commit_time else at
 
         duration = (rt_end_time - self.measure_start_time) * 1000 if self.measure_start_time else 0
         
         print(f"[GestureTest] Match Processed! Trial {self.completed_trials + 1} done. RT: {duration:.2f}ms", flush=True)
         
-        if self.logger:
-             self.logger.log_raw(self.completed_trials + 1, 
-                                self.target_gesture['GestureName'], 
-                                self.target_gesture['ID'], 
-                                [{
-                                    "type": "state_change", 
-                                    "data": {
-                                        "from": STATE_MEASURING, 
-                                        "to": STATE_COMPLETED if self.completed_trials + 1 >= self.max_trials else "NEXT_TRIAL",
-                                        "rt_ms": duration
-                                    },
-                                    "timestamp": int(time.time() * 1000)
-                                }])
+        self._log_state_change(STATE_MEASURING,
+                               STATE_COMPLETED if self.completed_trials + 1 >= self.max_trials else "NEXT_TRIAL",
+                               at, rt_ms=duration)
 
         self.completed_trials += 1
         self._next_trial()
+        # 試行の区切りでログを確実にディスクへ残す
+        if self.logger:
+            self.logger.sync()
 
+    @_locked
     def check_state(self):
         try:
-            # 時間経過チェック (COUNTDOWN)
-            if self.state == STATE_COUNTDOWN and self.countdown_start_time:
-                if time.time() - self.countdown_start_time >= 3.0:
-                    self.state = STATE_MEASURING
-                    self.measure_start_time = None
-                    self.match_hold_start_time = None
-
-            # ★追加: MEASURING中の時間経過チェック (ポーリング駆動での遷移)
-            if self.state == STATE_MEASURING:
-                # 1. マッチ確定後の表示時間終了チェック
-                if self.match_commit_time is not None:
-                     if time.time() - self.match_commit_time >= MATCH_DISPLAY_DURATION:
-                         self._process_match()
-                
-                # 2. 入力が来なくても、維持時間が経過していたら確定させるチェック
-                # (直前の状態が維持されていると仮定する)
-                elif self.match_hold_start_time is not None:
-                     elapsed = time.time() - self.match_hold_start_time
-                     if elapsed >= DWELL_TIME_THRESHOLD:
-                         self.match_commit_time = time.time()
-                         print(f"[GestureTest] Match Committed (via check_state).", flush=True)
-
+            # 時間経過による遷移はタイマーが行うので、ここでは現在の状態を返すだけ
+            now = time.monotonic()
             remaining = 0
             if self.state == STATE_COUNTDOWN and self.countdown_start_time:
-                elapsed = time.time() - self.countdown_start_time
-                remaining = max(0.0, 3.0 - elapsed)
+                elapsed = now - self.countdown_start_time
+                remaining = max(0.0, COUNTDOWN_DURATION - elapsed)
             
             # 維持進捗の計算
             progress = 0.0
@@ -420,14 +430,20 @@ class GestureTest:
                 if self.match_commit_time is not None:
                     progress = 1.0 
                 elif self.match_hold_start_time:
-                    elapsed = time.time() - self.match_hold_start_time
+                    elapsed = now - self.match_hold_start_time
                     progress = min(1.0, elapsed / DWELL_TIME_THRESHOLD)
 
             response = {
                 "state": self.state,
                 "current_trial": self.completed_trials + 1,
                 "total_trials": self.max_trials,
-                "current_input": self.current_input
+                "current_input": self.current_input,
+                # 今の入力にマッチするジェスチャーの ID (条件が厳しいものから。先頭が最有力)
+                "recognized_ids": list(self.matcher.classify(self.current_frame)),
+                "version": self.version,
+                # サーバーの時刻 [ms]: 最後に状態が変わった時刻 / この応答を作った時刻
+                "changed_at": _epoch_ms(self.changed_at),
+                "server_timestamp": _epoch_ms(now)
             }
             
             if self.state == STATE_COUNTDOWN:
@@ -437,13 +453,17 @@ class GestureTest:
                 tg = self.target_gesture
                 response["target"] = tg 
                 response["is_match"] = (self.match_commit_time is not None)
+                # 維持中 (マッチし始めて、まだ確定していない)。開始直後は match_progress が 0 なので、こちらで判定する
+                response["is_holding"] = (self.match_hold_start_time is not None and self.match_commit_time is None)
                 response["match_progress"] = progress 
+                response["dwell_time"] = DWELL_TIME_THRESHOLD
                 
             return response
         except Exception as e:
             print(f"Error in check_state: {e}", flush=True)
             return {"state": "ERROR", "error": str(e)}
 
+    @_locked
     def log_client_events(self, events):
         if self.logger and events:
             if isinstance(events, str):
@@ -470,5 +490,78 @@ class GestureTest:
                              
                     if isinstance(data, dict) and data.get('action') == "stimulus_rendered_on_client":
                          if self.state == STATE_MEASURING and self.measure_start_time is None:
-                             self.measure_start_time = time.time()
-                             print(f"[GestureTest] Client Render Trigger Received. Timer STARTED at {self.measure_start_time}", flush=True)
\ No newline at end of file
+                             self.measure_start_time = time.monotonic()
+                             print(f"[GestureTest] Client Render Trigger Received. Timer STARTED at {self.measure_start_time}", flush=True)
+
+    # =========================================================
+    #  状態の変化の通知 (/gesture/stream)
+    # =========================================================
+
+    def _publish(self, at=None):
+        """
+        画面に出る状態が前回から変わっていれば version を上げて、待っているストリームを起こす (ロック中に呼ぶ)
+        :param at: 変化した時刻 (time.monotonic() の値, None なら現在)
+        """
+        key = (
+            self.state, self.completed_trials, self.current_gesture_id,
+            tuple(sorted((str(k), str(v)) for k, v in (self.current_input or {}).items())),
+            self.measure_start_time is not None,
+            self.match_hold_start_time is not None,
+            self.match_commit_time is not None,
+        )
+        if key != self._published_key:
+            self._published_key = key
+            self.version += 1
+            self.changed_at = time.monotonic() if at is None else at
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """
+        version から状態が変わるまで待つ
+        :return: 現在の version (timeout までに変わらなければ引数と同じ)
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    # =========================================================
+    #  時間経過による遷移のタイマー
+    # =========================================================
+
+    def _schedule(self, deadline, callback):
+        """deadline (time.monotonic() の値) に callback(deadline) を呼ぶ (予約済みの遷移は置き換える。ロック中に呼ぶ)"""
+        self._timer_deadline = deadline
+        self._timer_callback = callback
+        self._changed.notify_all()
+
+    def _cancel_timer(self):
+        self._timer_deadline = None
+        self._timer_callback = None
+
+    def _run_timer(self):
+        """
+        タイマースレッド: 予約された期限まで待ってから遷移する
+        遷移はポーリングや入力の到着を待たずに期限ちょうどに行い、ログには期限の時刻を記録する。
+        """
+        with self._changed:
+            while True:
+                deadline = self._timer_deadline
+                if deadline is None:
+                    self._changed.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._changed.wait(remaining)
+                    continue
+                callback = self._timer_callback
+                self._cancel_timer()
+                try:
+                    callback(deadline)
+                except Exception as e:
+                    print(f"Error in gesture timer: {e}", flush=True)
+                self._publish(deadline)
+
+
+def _epoch_ms(monotonic_time):
+    """time.monotonic() の時刻を UNIX 時刻 [ms] に直す"""
+    return int((time.time() - (time.monotonic() - monotonic_time)) * 1000)
@@ -0,0 +1,341 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# 索引ファイル (.kidx) の形式
+#   ヘッダ : MAGIC(8) + バージョン(uint32) + セクション数(uint32) + 各セクションの (offset, length) (uint64 × 2)
+#   セクション (SECTIONS の順。数値配列はすべて uint32 リトルエンディアン、4byte境界に整列):
+#     meta            : JSON (キー対応表など)
+#     seq_key_offsets : キー列文字列の開始位置 (n_seq + 1)
+#     seq_key_blob    : キー列を昇順に連結したもの (ASCII)
+#     seq_word_start  : 各キー列に対応する単語が words の何番目から始まるか (n_seq + 1)
+#     word_offsets    : 単語文字列の開始位置 (n_words + 1)
+#     word_blob       : 単語を連結したもの (UTF-8)
+#     pref_key_offsets, pref_key_blob, pref_start, pstr_offsets, pstr_blob
+#                     : プレフィックス側の同じ構造
+INDEX_MAGIC = b"HKIDX\0\0\0"
+INDEX_VERSION = 1
+SECTIONS = (
+    "meta",
+    "seq_key_offsets", "seq_key_blob", "seq_word_start", "word_offsets", "word_blob",
+    "pref_key_offsets", "pref_key_blob", "pref_start", "pstr_offsets", "pstr_blob",
+)
+_HEADER = struct.Struct("<8sII")
+_SECTION = struct.Struct("<QQ")
+
+
+class KeySequenceIndex:
+    """
+    語彙を指のキー列 (インデックス列) で引けるようにした索引 (T9方式)
+
+    - words_by_sequence   : 完全なキー列 -> そのキー列になる単語のリスト
+    - prefixes_by_sequence: キー列のプレフィックス -> そのキー列で始まる単語の、
+                            同じ長さの文字列プレフィックス (重複なし)
+                            (プレフィックス木を、各ノードのキー列で引ける dict に平坦化したもの)
+
+    入力途中のキー列に対して「実在する単語 (またはその先頭部分)」だけを
+    候補として返せるので、言語モデルで採点する候補数を大きく減らせる。
+    """
+
+    def __init__(self, reverse_map):
+        """
+        :param reverse_map: 文字 -> キー の対応 (WordPredictor.REVERSE_QWERTY_MAP)
+        """
+        self.reverse_map = reverse_map
+        self.words_by_sequence = {}
+        self.prefixes_by_sequence = {}
+        self.word_count = 0
+
+    def to_sequence(self, word):
+        """単語をキー列に変換する。マップに無い文字を含む場合は None"""
+        keys = []
+        for char in word:
+            key = self.reverse_map.get(char)
+            if key is None:
+                return None
+            keys.append(key)
+        return "".join(keys)
+
+    def add_word(self, word):
+        word = word.strip().lower()
+        if not word:
+            return False
+        sequence = self.to_sequence(word)
+        if sequence is None:
+            return False
+
+        words = self.words_by_sequence.setdefault(sequence, [])
+        if word in words:
+            return False
+        words.append(word)
+        self.word_count += 1
+
+        for length in range(1, len(sequence) + 1):
+            prefixes = self.prefixes_by_sequence.setdefault(sequence[:length], {})
+            # dict を順序付き集合として使う (登録順を保つ)
+            prefixes[word[:length]] = None
+        return True
+
+    def words(self, index_seq):
+        """キー列に完全一致する単語"""
+        return self.words_by_sequence.get(index_seq, [])
+
+    def prefixes(self, index_seq):
+        """キー列で始まる単語の、入力長までの文字列プレフィックス"""
+        prefixes = self.prefixes_by_sequence.get(index_seq)
+        return list(prefixes) if prefixes else []
+
+    def __len__(self):
+        return self.word_count
+
+    def save(self, path):
+        """
+        索引を mmap で開ける形式 (.kidx) で保存する
+        キー列は昇順に並べ、単語・プレフィックスは詰めた文字列表へのオフセットで参照する。
+        """
+        seq_keys = sorted(self.words_by_sequence)
+        pref_keys = sorted(self.prefixes_by_sequence)
+
+        word_list, seq_word_start = _flatten(seq_keys, self.words_by_sequence)
+        pstr_list, pref_start = _flatten(pref_keys, self.prefixes_by_sequence)
+
+        meta = {
+            "version": INDEX_VERSION,
+            "reverse_map": self.reverse_map,
+            "word_count": self.word_count,
+            "sequence_count": len(seq_keys),
+            "prefix_count": len(pref_keys),
+        }
+
+        sections = {"meta": json.dumps(meta, ensure_ascii=False).encode('utf-8')}
+        sections["seq_key_offsets"], sections["seq_key_blob"] = _pack_strings(seq_keys)
+        sections["seq_word_start"] = _uint32_bytes(seq_word_start)
+        sections["word_offsets"], sections["word_blob"] = _pack_strings(word_list)
+        sections["pref_key_offsets"], sections["pref_key_blob"] = _pack_strings(pref_keys)
+        sections["pref_start"] = _uint32_bytes(pref_start)
+        sections["pstr_offsets"], sections["pstr_blob"] = _pack_strings(pstr_list)
+
+        offset = _HEADER.size + _SECTION.size * len(SECTIONS)
+        table = []
+        for name in SECTIONS:
+            offset = _align4(offset)
+            table.append((offset, len(sections[name])))
+            offset += len(sections[name])
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(SECTIONS)))
+            for entry in table:
+                f.write(_SECTION.pack(*entry))
+            for name, (start, _) in zip(SECTIONS, table):
+                f.write(b"\0" * (start - f.tell()))
+                f.write(sections[name])
+        # 書き込み途中のファイルを他プロセスが開かないように、最後に置き換える
+        os.replace(tmp_path, path)
+        print(f"[KeySequenceIndex] Saved {self.word_count} words to {path}")
+
+    # =========================================================
+    #  構築
+    # =========================================================
+
+    @classmethod
+    def from_words(cls, words, reverse_map):
+        index = cls(reverse_map)
+        for word in words:
+            index.add_word(word)
+        return index
+
+    @classmethod
+    def from_file(cls, path, reverse_map):
+        """
+        ファイルから索引を作る
+        - .json : words.json 形式 ({"words": [...]} または単語のリスト)
+        - .arpa : KenLMのARPAファイル (1-gramの語彙を使う)
+        - その他: 1行1単語のテキスト
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"語彙ファイルが見つかりません: {path}")
+
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".json":
+            words = _read_words_json(path)
+        elif ext == ".arpa":
+            words = _read_arpa_vocab(path)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                words = [line.strip() for line in f]
+
+        index = cls.from_words(words, reverse_map)
+        print(f"[KeySequenceIndex] Loaded {len(index)} words "
+              f"({len(index.words_by_sequence)} sequences) from {path}")
+        return index
+
+
+class MappedKeySequenceIndex:
+    """
+    KeySequenceIndex.save() で保存した索引ファイルを mmap で開いて引く読み取り専用の索引
+
+    ファイルは最初の検索時に開く (遅延オープン)。解析処理は無く、
+    昇順に並んだキー列を二分探索するだけなので起動直後からすぐ使える。
+    mmap したページは OS のページキャッシュで複数のワーカープロセス間で共有される。
+    """
+
+    def __init__(self, path, reverse_map=None):
+        """
+        :param reverse_map: 指定した場合、ファイルに保存されたキー対応表と一致するか確認する
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"索引ファイルが見つかりません: {path}")
+        self.path = path
+        self.reverse_map = reverse_map
+        self._mm = None
+        self.meta = None
+
+    def _open(self):
+        if self._mm is not None:
+            return
+        if sys.byteorder != "little":
+            raise RuntimeError("索引ファイルはリトルエンディアン環境でのみ読み込めます")
+
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_sections = _HEADER.unpack_from(mm, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or n_sections != len(SECTIONS):
+            mm.close()
+            raise ValueError(f"索引ファイルの形式が不正です: {self.path}")
+
+        view = memoryview(mm)
+        parts = {}
+        for i, name in enumerate(SECTIONS):
+            start, length = _SECTION.unpack_from(mm, _HEADER.size + _SECTION.size * i)
+            parts[name] = view[start:start + length]
+
+        meta = json.loads(bytes(parts["meta"]).decode('utf-8'))
+        if self.reverse_map is not None and meta.get("reverse_map") != self.reverse_map:
+            view.release()
+            mm.close()
+            raise ValueError(f"索引ファイルのキー対応表が現在の設定と一致しません: {self.path}")
+
+        self.meta = meta
+        self._seq_key_offsets = parts["seq_key_offsets"].cast('I')
+        self._seq_key_blob = parts["seq_key_blob"]
+        self._seq_word_start = parts["seq_word_start"].cast('I')
+        self._word_offsets = parts["word_offsets"].cast('I')
+        self._word_blob = parts["word_blob"]
+        self._pref_key_offsets = parts["pref_key_offsets"].cast('I')
+        self._pref_key_blob = parts["pref_key_blob"]
+        self._pref_start = parts["pref_start"].cast('I')
+        self._pstr_offsets = parts["pstr_offsets"].cast('I')
+        self._pstr_blob = parts["pstr_blob"]
+        self._mm = mm
+
+    def words(self, index_seq):
+        """キー列に完全一致する単語"""
+        self._open()
+        i = _bisect_key(self._seq_key_offsets, self._seq_key_blob, index_seq.encode('ascii'))
+        if i < 0:
+            return []
+        return _read_range(self._word_offsets, self._word_blob,
+                           self._seq_word_start[i], self._seq_word_start[i + 1])
+
+    def prefixes(self, index_seq):
+        """キー列で始まる単語の、入力長までの文字列プレフィックス"""
+        self._open()
+        i = _bisect_key(self._pref_key_offsets, self._pref_key_blob, index_seq.encode('ascii'))
+        if i < 0:
+            return []
+        return _read_range(self._pstr_offsets, self._pstr_blob,
+                           self._pref_start[i], self._pref_start[i + 1])
+
+    def __len__(self):
+        self._open()
+        return self.meta["word_count"]
+
+
+def open_index(path, reverse_map):
+    """拡張子に応じて索引を用意する (.kidx は mmap、それ以外は読み込んで構築)"""
+    if path.endswith(".kidx"):
+        return MappedKeySequenceIndex(path, reverse_map)
+    return KeySequenceIndex.from_file(path, reverse_map)
+
+
+def _flatten(keys, table):
+    """キーごとの文字列リストを1本に連結し、各キーの開始位置 (n + 1) を返す"""
+    flat = []
+    starts = [0]
+    for key in keys:
+        flat.extend(table[key])
+        starts.append(len(flat))
+    return flat, starts
+
+
+def _uint32_bytes(values):
+    return array('I', values).tobytes()
+
+
+def _pack_strings(strings):
+    offsets = array('I', [0])
+    blob = bytearray()
+    for s in strings:
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets.tobytes(), bytes(blob)
+
+
+def _align4(offset):
+    return (offset + 3) & ~3
+
+
+def _bisect_key(offsets, blob, target):
+    """昇順に並んだ文字列表から target を二分探索する。無ければ -1"""
+    lo, hi = 0, len(offsets) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        key = bytes(blob[offsets[mid]:offsets[mid + 1]])
+        if key < target:
+            lo = mid + 1
+        elif key > target:
+            hi = mid
+        else:
+            return mid
+    return -1
+
+
+def _read_range(offsets, blob, start, end):
+    return [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(start, end)]
+
+
+def _read_words_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('words', [])
+    return [w for w in data if isinstance(w, str)]
+
+
+def _read_arpa_vocab(path):
+    """ARPAファイルの \\1-grams: セクションから語彙を取り出す"""
+    words = []
+    in_unigrams = False
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('\\'):
+                if in_unigrams:
+                    break
+                in_unigrams = (line == '\\1-grams:')
+                continue
+            if not in_unigrams or not line:
+                continue
+            parts = line.split('\t')
+            if len(parts) < 2:
+                continue
+            word = parts[1]
+            if word in ('<s>', '</s>', '<unk>'):
+                continue
+            words.append(word)
+    return words
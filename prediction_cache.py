@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 共有予測キャッシュ (SQLite) のスキーマのバージョン。形式を変えたら上げる (古いファイルは作り直す)
+CACHE_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    key BLOB PRIMARY KEY,
+    candidates TEXT NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used);
+"""
+
+
+class SharedPredictionCache:
+    """
+    予測結果 (上位 limit 件) をプロセス間で共有するキャッシュ
+
+    参加者が違っても同じフレーズ (phrases2.txt) を打つので、同じキー列・同じ文脈の予測が何度も繰り返される。
+    結果をローカルの SQLite ファイル (WAL モード) に保存しておき、app.py のワーカープロセスが
+    互いの計算結果を再利用できるようにする。プロセスを再起動しても残る。
+
+    キーは (キー列, 文脈, ビームの設定, モデルの識別子) のハッシュ。モデルや設定が変わると
+    キーが変わるので、古い結果は使われずに、いずれ容量の制限で捨てられる。
+    容量は保存した候補の大きさの合計 (概算byte) で制限し、超えたら最後に使われた時刻が古いものから捨てる。
+    最後に使われた時刻は書き込みを減らすため TOUCH_SECONDS ごとにしか更新しないので、おおよその LRU になる。
+
+    キャッシュは高速化のためだけのものなので、ロック待ちなどで読み書きに失敗しても
+    例外は投げずにキャッシュに無いものとして扱う (errors で回数が分かる)。
+    """
+    # 最後に使われた時刻を更新する間隔 [s]
+    TOUCH_SECONDS = 60.0
+    # 何回保存するごとに容量を確認するか
+    EVICT_CHECK_INTERVAL = 256
+    # 容量を超えたら、この割合まで減らす
+    EVICT_TARGET = 0.9
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, timeout=0.05):
+        """
+        :param path: SQLite のファイルパス (無ければ作る)
+        :param max_bytes: 保存する候補の合計の上限 (概算byte)
+        :param timeout: 他プロセスの書き込みを待つ時間 [s]。予測の遅延に直結するので短くしておく
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+        # SQLite の接続はスレッドをまたいで使えないので、スレッドごとに持つ
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = self._connection()
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CACHE_VERSION:
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS predictions")
+                connection.executescript(_SCHEMA)
+                connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        print(f"[SharedPredictionCache] Opened {path} ({len(self)} entries)")
+
+    def __len__(self):
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        except sqlite3.Error:
+            self.errors += 1
+            return 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        # fork したプロセスでは親の接続を使わない
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def make_key(namespace, index_seq, context_words, width, limit):
+        """
+        キャッシュのキー (16byte のハッシュ)
+        :param namespace: モデルの識別子やデコーダの設定など、結果を左右するもの (文字列)
+        :param context_words: 文脈の単語列 (モデルが参照する直近の単語だけでよい)
+        """
+        text = "\n".join((namespace, index_seq, " ".join(context_words), str(width), str(limit)))
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key):
+        """
+        :return: (score, word) のリスト。無ければ None
+        """
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT candidates, last_used FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - row[1] > self.TOUCH_SECONDS:
+                connection.execute("UPDATE predictions SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            self.errors += 1
+            return None
+        self.hits += 1
+        return [(score, word) for score, word in json.loads(row[0])]
+
+    def put(self, key, candidates):
+        """(score, word) のリストを保存する"""
+        data = json.dumps(candidates, separators=(",", ":"))
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO predictions (key, candidates, nbytes, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, len(key) + len(data), time.time()))
+            self.stores += 1
+            if self.stores % self.EVICT_CHECK_INTERVAL == 0:
+                self._evict(connection)
+        except sqlite3.Error:
+            self.errors += 1
+
+    def _evict(self, connection):
+        """容量を超えていたら、最後に使われた時刻が古いものから EVICT_TARGET まで捨てる"""
+        total = connection.execute("SELECT COALESCE(SUM(nbytes), 0) FROM predictions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * self.EVICT_TARGET)
+        with connection:
+            cutoff = connection.execute(
+                "SELECT last_used FROM (SELECT last_used, SUM(nbytes) OVER (ORDER BY last_used) AS freed "
+                "FROM predictions) WHERE freed >= ? LIMIT 1", (excess,)).fetchone()
+            if cutoff is not None:
+                connection.execute("DELETE FROM predictions WHERE last_used <= ?", cutoff)
+        print(f"[SharedPredictionCache] Evicted {excess / 1024:.0f} KB (limit {self.max_bytes / 1024:.0f} KB)")
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM predictions")
+        except sqlite3.Error:
+            self.errors += 1
+
+    def stats(self):
+        return {"path": self.path, "entries": len(self), "hits": self.hits, "misses": self.misses,
+                "stores": self.stores, "errors": self.errors}
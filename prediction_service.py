@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from word_predictor import PredictionCancelled
+
+
+class _Job:
+    """実行中の予測1件 (同じ入力のリクエストはこれを共有して待つ)"""
+    __slots__ = ("future", "cancel", "waiters")
+
+    def __init__(self, future, cancel):
+        self.future = future
+        self.cancel = cancel
+        self.waiters = 0
+
+
+class PredictionService:
+    """
+    予測を asyncio のイベントループで受け付け、重複をまとめ、古い入力を取り消すサービス
+
+    参加者が速く打つと、クライアントはキー入力のたびに /predict を送る。
+    古い入力のビームサーチが最後まで走ると CPU を奪い、結果も新しい入力の結果より後に届くので、
+    - 同じセッションに新しいリクエストが来たら、待っている古いリクエストは PredictionCancelled で即座に返し、
+      他に待っている人がいなければ予測自体も取り消す (実行前なら実行せず、実行中ならビームサーチを次のステップで止める)
+    - 同じ入力 (key が等しい) のリクエストが同時に来たら、予測は1回だけ行って結果を全員に返す
+    ことで、CPU は最新の入力にだけ使うようにする。
+
+    イベントループは専用のスレッドで動かし、予測 (ビームサーチ) はスレッドプールで実行する。
+    Flask のような同期的なサーバーからは run()、asyncio のコードからは predict() を呼ぶ。
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        :param max_workers: 同時に実行する予測の数
+        """
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="predict")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="prediction-service", daemon=True)
+        self._thread.start()
+        # key -> 実行中の _Job
+        self._jobs = {}
+        # セッションのキー -> そのセッションの最新のリクエストを待っているタスク
+        self._latest = {}
+        self.completed = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.cancelled = 0
+
+    def run(self, session_key, key, func, timeout=None):
+        """
+        predict() を別スレッドから呼んで結果を待つ
+        :raises PredictionCancelled: 同じセッションの新しいリクエストに置き換えられた
+        """
+        future = asyncio.run_coroutine_threadsafe(self.predict(session_key, key, func), self._loop)
+        return future.result(timeout)
+
+    async def predict(self, session_key, key, func):
+        """
+        予測を行う (イベントループ上で呼ぶ)
+        :param session_key: リクエストを送ったセッション。同じセッションの新しいリクエストが来たら、このリクエストは取り消す。
+                            None なら取り消さない
+        :param key: 予測の入力を表すハッシュ可能な値。等しいリクエストは1回の予測にまとめる
+        :param func: 予測を行う関数 func(cancel)。cancel (threading.Event) がセットされたら途中で止めてよい
+        :return: func の戻り値
+        :raises PredictionCancelled: 同じセッションの新しいリクエストに置き換えられた
+        """
+        waiter = asyncio.current_task()
+        if session_key is not None:
+            previous = self._latest.get(session_key)
+            if previous is not None and not previous.done():
+                previous.cancel()
+            self._latest[session_key] = waiter
+
+        job = self._jobs.get(key)
+        if job is None:
+            job = self._start(key, func)
+        else:
+            self.coalesced += 1
+        job.waiters += 1
+        try:
+            # 待っている1人が取り消されても、予測自体は他の人のために続ける
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            self.superseded += 1
+            raise PredictionCancelled(key) from None
+        finally:
+            job.waiters -= 1
+            if job.waiters == 0 and not job.future.done():
+                # 誰も結果を待っていないので、予測を止める
+                job.cancel.set()
+                job.future.cancel()
+                self.cancelled += 1
+            if session_key is not None and self._latest.get(session_key) is waiter:
+                del self._latest[session_key]
+
+    def _start(self, key, func):
+        cancel = threading.Event()
+        job = _Job(self._loop.run_in_executor(self._executor, func, cancel), cancel)
+        self._jobs[key] = job
+        job.future.add_done_callback(lambda future: self._finish(key, job))
+        return job
+
+    def _finish(self, key, job):
+        if self._jobs.get(key) is job:
+            del self._jobs[key]
+        if not job.future.cancelled():
+            # 例外は待っている人に伝わる。誰も待っていない場合に警告が出ないように取り出しておく
+            if job.future.exception() is None:
+                self.completed += 1
+
+    def stats(self):
+        return {"in_flight": len(self._jobs), "completed": self.completed, "coalesced": self.coalesced,
+                "superseded": self.superseded, "cancelled": self.cancelled}
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
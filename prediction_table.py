@@ -0,0 +1,214 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# 予測表ファイル (.ptab) の形式
+#   ヘッダ : MAGIC(8) + バージョン(uint32) + セクション数(uint32) + 各セクションの (offset, length) (uint64 × 2)
+#   セクション (SECTIONS の順。数値配列はリトルエンディアン、4byte境界に整列):
+#     meta        : JSON (キー対応表・最大長・作成時の設定など)
+#     slot_start  : 各キー列の候補が何番目から始まるか (uint32, n_slots + 1)
+#     scores      : 候補のスコア (float32, スコア降順)
+#     word_blob   : 候補の単語を連結したもの (ASCII)。
+#                   長さ n のキー列の候補は n 文字なので、区切りやオフセットは持たない
+#
+# キー列は「長さごとの通し番号」で表の位置 (スロット) に直接対応させる。
+#   slot = (長さ n より短いキー列の総数) + キー列を keys の並びで B 進数とみなした値  (B = キーの種類数)
+# なので、検索は二分探索すら要らず配列を1回引くだけで済む。
+TABLE_MAGIC = b"HPTAB\0\0\0"
+TABLE_VERSION = 1
+SECTIONS = ("meta", "slot_start", "scores", "word_blob")
+_HEADER = struct.Struct("<8sII")
+_SECTION = struct.Struct("<QQ")
+
+
+class PredictionTable:
+    """
+    短いキー列 (最大 max_length キー) の予測結果を事前計算しておく表
+
+    単語の最初の数キーは組み合わせ数が少ない (4キーでも最大 6^4) 一方、
+    入力のほとんどを占めるので、文頭 (左文脈なし) での予測結果を
+    build_prediction_table.py でオフラインに全キー列ぶん計算し、ファイルに保存しておく。
+    ファイルは mmap で開くので、起動時の読み込みは不要。
+    """
+
+    def __init__(self, path, qwerty_map=None):
+        """
+        :param qwerty_map: 指定した場合、ファイルに保存されたキー対応表と一致するか確認する
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"予測表ファイルが見つかりません: {path}")
+        if sys.byteorder != "little":
+            raise RuntimeError("予測表ファイルはリトルエンディアン環境でのみ読み込めます")
+        self.path = path
+
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_sections = _HEADER.unpack_from(mm, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION or n_sections != len(SECTIONS):
+            mm.close()
+            raise ValueError(f"予測表ファイルの形式が不正です: {path}")
+
+        view = memoryview(mm)
+        parts = {}
+        for i, name in enumerate(SECTIONS):
+            start, length = _SECTION.unpack_from(mm, _HEADER.size + _SECTION.size * i)
+            parts[name] = view[start:start + length]
+
+        meta = json.loads(bytes(parts["meta"]).decode('utf-8'))
+        if qwerty_map is not None and meta.get("qwerty_map") != qwerty_map:
+            view.release()
+            mm.close()
+            raise ValueError(f"予測表ファイルのキー対応表が現在の設定と一致しません: {path}")
+
+        self.meta = meta
+        self.max_length = meta["max_length"]
+        self.top_k = meta["top_k"]
+        self._digits = {key: i for i, key in enumerate(meta["keys"])}
+        self._base = len(meta["keys"])
+        self._length_offsets = _length_offsets(self._base, self.max_length)
+        self._slot_start = parts["slot_start"].cast('I')
+        self._scores = parts["scores"].cast('f')
+        self._word_blob = parts["word_blob"]
+        self._mm = mm
+
+    def lookup(self, index_seq):
+        """
+        キー列の予測結果を引く
+        :return: (score, word) のリスト (スコア降順、最大 top_k 件)。表の範囲外なら None
+        """
+        length = len(index_seq)
+        if not 0 < length <= self.max_length:
+            return None
+        slot = _slot(index_seq, self._digits, self._base, self._length_offsets)
+        if slot is None:
+            return None
+
+        start, end = self._slot_start[slot], self._slot_start[slot + 1]
+        scores = self._scores
+        blob = self._word_blob
+        # このスロットより前の候補はすべて同じ長さ (length 文字) なので、単語の位置は計算で求まる
+        base = (start - self._entries_before(length)) * length + self._bytes_before(length)
+        return [
+            (scores[i], bytes(blob[base + j * length:base + (j + 1) * length]).decode('ascii'))
+            for j, i in enumerate(range(start, end))
+        ]
+
+    def _entries_before(self, length):
+        """長さ length のキー列より前にある候補の総数"""
+        return self._slot_start[self._length_offsets[length - 1]]
+
+    def _bytes_before(self, length):
+        """長さ length のキー列より前にある単語の総バイト数"""
+        return self.meta["length_bytes"][length - 1]
+
+    def __len__(self):
+        return len(self._slot_start) - 1
+
+    @staticmethod
+    def save(path, predictions, qwerty_map, max_length, top_k, info=None):
+        """
+        予測結果を表ファイル (.ptab) に保存する
+        :param predictions: {キー列: (score, word) のリスト}。max_length 以下の全キー列を含むこと
+        :param info: meta に一緒に保存する作成時の設定 (モデル名・ビーム幅など)
+        """
+        keys = sorted(qwerty_map)
+        digits = {key: i for i, key in enumerate(keys)}
+        base = len(keys)
+        offsets = _length_offsets(base, max_length)
+
+        slots = [None] * offsets[-1]
+        for index_seq, candidates in predictions.items():
+            slot = _slot(index_seq, digits, base, offsets)
+            if slot is None or not 0 < len(index_seq) <= max_length:
+                continue
+            slots[slot] = candidates[:top_k]
+        missing = sum(1 for s in slots if s is None)
+        if missing:
+            raise ValueError(f"予測結果が無いキー列があります ({missing}件)")
+
+        slot_start = array('I', [0])
+        scores = array('f')
+        blob = bytearray()
+        # 長さごとの単語の開始バイト位置 (lookup で単語の位置を計算するのに使う)
+        length_bytes = []
+        for length in range(1, max_length + 1):
+            length_bytes.append(len(blob))
+            for slot in range(offsets[length - 1], offsets[length]):
+                for score, word in slots[slot]:
+                    if len(word) != length:
+                        raise ValueError(f"キー列と長さの異なる候補があります: {word}")
+                    scores.append(score)
+                    blob += word.encode('ascii')
+                slot_start.append(len(scores))
+
+        meta = {
+            "version": TABLE_VERSION,
+            "qwerty_map": qwerty_map,
+            "keys": keys,
+            "max_length": max_length,
+            "top_k": top_k,
+            "length_bytes": length_bytes,
+            "info": info or {},
+        }
+        sections = {
+            "meta": json.dumps(meta, ensure_ascii=False).encode('utf-8'),
+            "slot_start": slot_start.tobytes(),
+            "scores": scores.tobytes(),
+            "word_blob": bytes(blob),
+        }
+
+        offset = _HEADER.size + _SECTION.size * len(SECTIONS)
+        table = []
+        for name in SECTIONS:
+            offset = _align4(offset)
+            table.append((offset, len(sections[name])))
+            offset += len(sections[name])
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, len(SECTIONS)))
+            for entry in table:
+                f.write(_SECTION.pack(*entry))
+            for name, (start, _) in zip(SECTIONS, table):
+                f.write(b"\0" * (start - f.tell()))
+                f.write(sections[name])
+        # 書き込み途中のファイルを他プロセスが開かないように、最後に置き換える
+        os.replace(tmp_path, path)
+        print(f"[PredictionTable] Saved {len(slots)} sequences ({len(scores)} candidates) to {path}")
+
+
+def all_sequences(keys, max_length):
+    """長さ 1 〜 max_length の全キー列 (スロット順)"""
+    keys = sorted(keys)
+    sequences = []
+    level = [""]
+    for _ in range(max_length):
+        level = [seq + key for seq in level for key in keys]
+        sequences.extend(level)
+    return sequences
+
+
+def _length_offsets(base, max_length):
+    """offsets[n] = 長さ n 以下のキー列の総数 (offsets[0] = 0)"""
+    offsets = [0]
+    for length in range(1, max_length + 1):
+        offsets.append(offsets[-1] + base ** length)
+    return offsets
+
+
+def _slot(index_seq, digits, base, offsets):
+    value = 0
+    for i_char in index_seq:
+        digit = digits.get(i_char)
+        if digit is None:
+            return None
+        value = value * base + digit
+    return offsets[len(index_seq) - 1] + value
+
+
+def _align4(offset):
+    return (offset + 3) & ~3
@@ -40,6 +40,13 @@ document.addEventListener('DOMContentLoaded', () => {
     // Logging Buffer
     let eventLogBuffer = [];
 
+    // Prediction session (keeps this tab's decoder state separate on the server)
+    const predictSessionId = (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    // Number of the latest /predict request (responses to older requests are ignored)
+    let predictRequestSeq = 0;
+
     // --- Keyboard Index Initialization ---
     if (typeof REVERSE_QWERTY_MAP !== 'undefined') {
         keyboardKeys.forEach(keyElement => {
@@ -244,6 +251,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     input.addEventListener('input', async () => {
         const word = input.value.trim();
+        const requestSeq = ++predictRequestSeq;
         
         if (!word) {
             currentPredictions = [];
@@ -257,9 +265,11 @@ document.addEventListener('DOMContentLoaded', () => {
             const res = await fetch('/predict', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ word: word })
+                body: JSON.stringify({ word: word, context: committedWords, session_id: predictSessionId })
             });
             const data = await res.json();
+            // A newer keystroke has been sent: the server cancelled this one, or its result is already stale
+            if (data.superseded || requestSeq !== predictRequestSeq) return;
             
             currentPredictions = data.predictions || [];
             selectedIndex = currentPredictions.length > 0 ? 0 : -1;
@@ -23,7 +23,14 @@ document.addEventListener('DOMContentLoaded', () => {
     const overlayText = document.getElementById('overlay-text');
 
     const fingerIds = ['T', 'I', 'M', 'R', 'P'];
-    let pollingInterval = null;
+    // Server push of the test state (/gesture/stream, sent only when the state changes)
+    let stateStream = null;
+    // Handling of pushed states is serialized (each one may await a log upload)
+    let stateQueue = Promise.resolve();
+    // Latest pushed state and when it arrived, for animating the countdown / progress bar locally
+    let lastState = null;
+    let lastStateReceivedAt = 0;
+    let animationFrame = null;
 
     let isTestRunning = false;
     let eventLogBuffer = [];
@@ -140,7 +147,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 isTestRunning = true;
                 configSection.style.display = 'none';
                 testSection.style.display = 'block';
-                startPolling();
+                startStateStream();
             } else {
                 throw new Error("Unknown status received from server");
             }
@@ -150,13 +157,52 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    function startPolling() {
-        if (pollingInterval) clearInterval(pollingInterval);
+    function startStateStream() {
+        stopStateStream();
         isFetchingState = false; 
-        pollingInterval = setInterval(checkState, 33); 
+        stateStream = new EventSource('/gesture/stream');
+        stateStream.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            const receivedAt = performance.now();
+            stateQueue = stateQueue.then(() => handleState(data, receivedAt));
+        };
+        stateStream.onerror = () => {
+            // EventSource reconnects by itself
+            console.warn("State stream disconnected. Reconnecting...");
+        };
+        animationFrame = requestAnimationFrame(animate);
+    }
+
+    function stopStateStream() {
+        if (stateStream) {
+            stateStream.close();
+            stateStream = null;
+        }
+        if (animationFrame) {
+            cancelAnimationFrame(animationFrame);
+            animationFrame = null;
+        }
+        lastState = null;
     }
 
-    async function checkState() {
+    // Countdown and dwell progress change continuously, so they are extrapolated
+    // from the last pushed state instead of being pushed every frame.
+    function animate() {
+        animationFrame = requestAnimationFrame(animate);
+        const data = lastState;
+        if (!data || !isTestRunning) return;
+        const elapsed = (performance.now() - lastStateReceivedAt) / 1000;
+
+        if (data.state === 'COUNTDOWN') {
+            const remaining = Math.max(0, data.countdown_remaining - elapsed);
+            overlayText.textContent = `Get Ready... ${Math.ceil(remaining)}`;
+        } else if (data.state === 'MEASURING' && data.is_holding) {
+            const progress = Math.min(1.0, data.match_progress + elapsed / data.dwell_time);
+            matchProgressBar.style.width = `${progress * 100}%`;
+        }
+    }
+
+    async function handleState(data, receivedAt) {
         if (isFetchingState) return;
         isFetchingState = true;
 
@@ -165,14 +211,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 await uploadLogs();
             }
 
-            const res = await fetch('/gesture/state');
-            if (!res.ok) {
-                console.warn("Polling response not OK:", res.status);
-                return;
-            }
-            const data = await res.json(); 
-
             if (!isTestRunning) return;
+            lastState = data;
+            lastStateReceivedAt = receivedAt;
 
             if (data.state === 'IDLE') {
                 alert("Server reset detected. The test will be aborted.");
@@ -224,7 +265,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
                         logEvent('system', { 
                             action: "stimulus_rendered_on_client",
-                            trial_id: data.current_trial 
+                            trial_id: data.current_trial,
+                            // Server time (ms) when MEASURING was entered / this state was pushed
+                            server_changed_at: data.changed_at
                         });
                         
                         await uploadLogs(); 
@@ -245,7 +288,7 @@ document.addEventListener('DOMContentLoaded', () => {
             }
 
         } catch (e) {
-            console.error("Polling error:", e);
+            console.error("State handling error:", e);
         } finally {
             isFetchingState = false;
         }
@@ -266,10 +309,7 @@ document.addEventListener('DOMContentLoaded', () => {
     async function finishTest() {
         if (!isTestRunning) return; 
         
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
-            pollingInterval = null;
-        }
+        stopStateStream();
         
         logEvent('system', 'test_finished');
         
@@ -318,10 +358,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function resetToConfig() {
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
-            pollingInterval = null;
-        }
+        stopStateStream();
         isTestRunning = false;
         isFetchingState = false;
         
@@ -6,6 +6,8 @@ import random
 from datetime import datetime,timezone, timedelta
 # from collections import defaultdict
 
+from event_log import ARROW_AVAILABLE, ArrowEventLog, shared_writer
+
 jst = timezone(timedelta(hours=9))
 
 class Logger:
@@ -26,6 +28,9 @@ class Logger:
         if not os.path.exists(self.log_dir):
             os.makedirs(self.log_dir)
 
+        # 書き込みはバックグラウンドのスレッドがまとめて行う (リクエストのスレッドではファイルを開かない)
+        self.writer = shared_writer()
+
         now_str = datetime.now(jst).strftime("%Y-%m-%d-%H-%M-%S")
         self.raw_path = os.path.join(self.log_dir, f"log_{participant_id}_{now_str}_typing_raw.csv")
         
@@ -35,6 +40,15 @@ class Logger:
             "EventType", "EventData", "ClientTimestamp"
         ])
 
+        # 解析用に同じ内容を列指向の形式 (_raw.arrow) でも保存する (pyarrow がある場合)
+        self.columnar = None
+        if ARROW_AVAILABLE:
+            self.columnar = ArrowEventLog(self.raw_path[:-len(".csv")] + ArrowEventLog.SUFFIX, [
+                ("Timestamp", "timestamp"), ("ParticipantID", "string"), ("Condition", "string"),
+                ("Handedness", "string"), ("TrialID", "int64"), ("PhraseID", "int64"),
+                ("EventType", "string"), ("EventData", "string"), ("ClientTimestamp", "int64")
+            ])
+
     def _init_csv(self, filepath, header):
         with open(filepath, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
@@ -42,20 +56,25 @@ class Logger:
 
     def log_raw(self, trial_id, phrase_id, events):
         if not events: return
-        with open(self.raw_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            for e in events:
-                writer.writerow([
-                    datetime.now(jst).isoformat(),
-                    self.participant_id,
-                    self.condition,
-                    self.handedness,
-                    trial_id,
-                    phrase_id, # PhraseIDを記録
-                    e.get('type'),
-                    e.get('data'),
-                    e.get('timestamp')
-                ])
+        rows = [[
+            datetime.now(jst).isoformat(),
+            self.participant_id,
+            self.condition,
+            self.handedness,
+            trial_id,
+            phrase_id, # PhraseIDを記録
+            e.get('type'),
+            e.get('data'),
+            e.get('timestamp')
+        ] for e in events]
+        self.writer.append(self.raw_path, rows)
+        if self.columnar is not None:
+            self.writer.append(self.columnar, [(row, e.get('data')) for row, e in zip(rows, events)])
+
+    def sync(self):
+        """ここまでのログをディスクに書き込む (フレーズの区切りで呼ぶ)"""
+        # 同期は書き込みスレッドに任せて待たない (状態の遷移を fsync で遅らせない)
+        self.writer.flush(fsync=True, wait=False)
 
 class TypingTest:
     def __init__(self):
@@ -110,6 +129,10 @@ class TypingTest:
             self.test_phrase_queue = []
 
     def loadReferenceText(self):
+        # 前のフレーズのログを確実に残してから次へ進む
+        if self.logger:
+            self.logger.sync()
+
         if not self.test_phrase_queue:
             self.reference_text = "No phrases loaded."
             self.reference_words = []
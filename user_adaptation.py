@@ -0,0 +1,235 @@
+import json
+import math
+import os
+import threading
+
+from word_predictor import REVERSE_QWERTY_MAP
+
+# 保存ファイルの形式のバージョン
+ADAPTATION_VERSION = 1
+
+
+class UserCacheModel:
+    """
+    参加者ごとのキャッシュ言語モデル (ユニグラム + バイグラム)
+
+    確定した単語を数えておき、予測候補のスコアを言語モデルと線形補間する。
+        P(w|prev) = (1 - weight) * P_lm(w|文脈) + weight * P_cache(w|prev)
+        P_cache(w|prev) = bigram_weight * C(prev, w) / C(prev, *) + (1 - bigram_weight) * C(w) / N
+    候補は入力途中の単語なので、C(w) は「w で始まる確定済みの単語の数」として数える。
+    そのため単語を確定するたびに、キー列のプレフィックス -> 文字列のプレフィックス -> 回数 の索引を更新しておき、
+    予測時は入力中のキー列で dict を1回引くだけで済むようにしている。
+
+    確定済みの単語の回数だけを JSON で保存し、索引は読み込み時に作り直す。
+    """
+
+    def __init__(self, path=None, weight=0.2, bigram_weight=0.5):
+        """
+        :param path: 保存先の JSON ファイル (None なら保存しない)。あれば読み込む
+        :param weight: 言語モデルとの補間でキャッシュに与える重み
+        :param bigram_weight: キャッシュ内でのバイグラムの重み
+        """
+        if not 0.0 <= weight < 1.0:
+            raise ValueError(f"weight は 0 以上 1 未満にしてください: {weight}")
+        self.path = path
+        self.weight = weight
+        self.bigram_weight = bigram_weight
+        self.unigrams = {}
+        self.bigrams = {}
+        self.total = 0
+        # キー列のプレフィックス -> {文字列のプレフィックス: 回数}
+        self._prefixes = {}
+        # (直前の単語, キー列のプレフィックス) -> {文字列のプレフィックス: 回数}
+        self._bigram_prefixes = {}
+        # 直前の単語 -> その後に確定した単語の数
+        self._followers = {}
+        # 今のフレーズで確定済みとして数えた単語
+        self._phrase_words = []
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def __len__(self):
+        return self.total
+
+    # =========================================================
+    #  更新
+    # =========================================================
+
+    def new_phrase(self):
+        """次のフレーズに進んだら呼ぶ (以降の単語は新しい文として数える)"""
+        with self._lock:
+            self._phrase_words = []
+
+    def confirm(self, words):
+        """
+        今のフレーズで確定した単語列 (先頭から) を渡す
+        前回までに数えた単語の続きだけを追加で数えるので、同じ単語列を何度渡してもよい。
+        :return: 新しく数えた単語数
+        """
+        words = [w.strip().lower() for w in words if w and w.strip()]
+        with self._lock:
+            common = 0
+            while (common < len(words) and common < len(self._phrase_words)
+                   and words[common] == self._phrase_words[common]):
+                common += 1
+            if common < len(self._phrase_words):
+                # 取り消された単語は数えたまま、以降を差し替える
+                self._phrase_words = self._phrase_words[:common]
+
+            added = 0
+            for i in range(common, len(words)):
+                previous = words[i - 1] if i > 0 else None
+                if self._add(previous, words[i], 1):
+                    added += 1
+                self._phrase_words.append(words[i])
+            if added:
+                self._dirty = True
+            return added
+
+    def _add(self, previous, word, count):
+        sequence = _to_sequence(word)
+        if sequence is None:
+            return False
+        self.unigrams[word] = self.unigrams.get(word, 0) + count
+        self.total += count
+        for length in range(1, len(word) + 1):
+            counts = self._prefixes.setdefault(sequence[:length], {})
+            counts[word[:length]] = counts.get(word[:length], 0) + count
+
+        if previous is not None:
+            key = f"{previous} {word}"
+            self.bigrams[key] = self.bigrams.get(key, 0) + count
+            self._followers[previous] = self._followers.get(previous, 0) + count
+            for length in range(1, len(word) + 1):
+                counts = self._bigram_prefixes.setdefault((previous, sequence[:length]), {})
+                counts[word[:length]] = counts.get(word[:length], 0) + count
+        return True
+
+    # =========================================================
+    #  予測
+    # =========================================================
+
+    def rescore(self, candidates, index_seq, context_words, lm_score):
+        """
+        予測候補のスコアをキャッシュと補間し直す
+        キャッシュにあってビームに無い候補 (このキー列で始まる確定済みの単語) も加える。
+        :param candidates: (score, word) のリスト (スコアは log10)
+        :param context_words: 左文脈の単語列 (直前の単語をバイグラムに使う)
+        :param lm_score: word -> 言語モデルのスコア (log10)。ビームに無い候補の採点に使う
+        :return: (score, word) のリスト (スコア降順)
+        """
+        if self.total == 0:
+            return candidates
+
+        previous = context_words[-1] if context_words else None
+        with self._lock:
+            unigram = self._prefixes.get(index_seq)
+            if not unigram:
+                return candidates
+            unigram = dict(unigram)
+            bigram = dict(self._bigram_prefixes.get((previous, index_seq), {}))
+            followers = self._followers.get(previous, 0)
+            total = self.total
+
+        lm_weight = 1.0 - self.weight
+        bigram_weight = self.bigram_weight if followers else 0.0
+        # キャッシュに無い候補は同じ係数が掛かるだけなので、順位は変わらない
+        shift = math.log10(lm_weight)
+        scores = {word: score + shift for score, word in candidates}
+
+        lm_scores = {word: score for score, word in candidates}
+        for word, count in unigram.items():
+            p_cache = (1.0 - bigram_weight) * count / total
+            if bigram_weight:
+                p_cache += bigram_weight * bigram.get(word, 0) / followers
+            score = lm_scores.get(word)
+            if score is None:
+                score = lm_score(word)
+            scores[word] = math.log10(lm_weight * 10 ** score + self.weight * p_cache)
+
+        return sorted(((score, word) for word, score in scores.items()), key=lambda c: c[0], reverse=True)
+
+    # =========================================================
+    #  保存・読み込み
+    # =========================================================
+
+    def save(self, force=False):
+        """確定した単語の回数を JSON で保存する (変更が無ければ何もしない)"""
+        if not self.path or not (self._dirty or force):
+            return
+        with self._lock:
+            data = {
+                "version": ADAPTATION_VERSION,
+                "unigrams": dict(self.unigrams),
+                "bigrams": dict(self.bigrams),
+            }
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def _load(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != ADAPTATION_VERSION:
+            raise ValueError(f"キャッシュモデルのファイル形式が不正です: {path}")
+
+        # _add はバイグラムと一緒にユニグラムも数えるので、ユニグラムはバイグラムで数えた残りだけを追加する
+        unigrams = dict(data.get("unigrams", {}))
+        for key, count in data.get("bigrams", {}).items():
+            previous, word = key.split(" ", 1)
+            self._add(previous, word, count)
+            unigrams[word] = unigrams.get(word, 0) - count
+        for word, count in unigrams.items():
+            if count > 0:
+                self._add(None, word, count)
+        print(f"[UserCacheModel] Loaded {self.total} words from {path}")
+
+
+class UserCacheStore:
+    """参加者ID -> UserCacheModel (保存先は directory/<参加者ID>.json)"""
+
+    def __init__(self, directory, weight=0.2, bigram_weight=0.5):
+        self.directory = directory
+        self.weight = weight
+        self.bigram_weight = bigram_weight
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, participant_id):
+        model = self._models.get(participant_id)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(participant_id)
+            if model is None:
+                path = None
+                if self.directory:
+                    path = os.path.join(self.directory, f"{_safe_name(participant_id)}.json")
+                model = UserCacheModel(path, self.weight, self.bigram_weight)
+                self._models[participant_id] = model
+            return model
+
+    def save_all(self):
+        for model in list(self._models.values()):
+            model.save()
+
+
+def _to_sequence(word):
+    keys = []
+    for char in word:
+        key = REVERSE_QWERTY_MAP.get(char)
+        if key is None:
+            return None
+        keys.append(key)
+    return "".join(keys)
+
+
+def _safe_name(participant_id):
+    """参加者IDをファイル名に使える形にする"""
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(participant_id)) or "_"
@@ -1,14 +1,294 @@
 import kenlm
 import os
 import subprocess
+import heapq
+import threading
+import time
+from array import array
+from collections import namedtuple
+import numpy as np
+from frontier_cache import FrontierCache
+from char_ngram import CHAR_NGRAM_SUFFIX, CharNgramModel
+from key_index import open_index
+from prediction_table import PredictionTable
+from prediction_cache import SharedPredictionCache
+
+PRUNE_METHODS = ("partition", "heap", "sort")
+
+# KenLM のバイナリモデルの読み込み方法
+#   "lazy"     : mmap して、参照されたページだけ読み込む (起動が最速。ページキャッシュを全プロセスで共有)
+#   "populate" : mmap して全ページを先読みする (共有しつつ、最初の予測からディスクを待たない。mmap できなければ read)
+#   "read"     : プロセスのメモリに読み込む (プロセスごとに複製される)
+#   "parallel_read" : "read" を複数スレッドで行う
+# ARPA (テキスト) のモデルはどの方法でもプロセスのメモリに読み込まれる
+LOAD_METHODS = {
+    "lazy": kenlm.LoadMethod.LAZY,
+    "populate": kenlm.LoadMethod.POPULATE_OR_READ,
+    "read": kenlm.LoadMethod.READ,
+    "parallel_read": kenlm.LoadMethod.PARALLEL_READ,
+}
+
+# デコーダの結果のバージョン。予測結果が変わる修正をしたら上げる
+# (共有キャッシュのキーに含めるので、ディスクに残った古い実装の結果は使われなくなる)
+DECODER_VERSION = 1
+
+# beam_width にこの値を渡すと、ステップごとにビーム幅を自動で決める (WordPredictor.ADAPTIVE_* 参照)
+ADAPTIVE_WIDTH = "auto"
+
+# 左文脈: 確定済みの単語列 / それを読み込んだ後の KenLM の状態 / legacy用の文字列
+# セッションからは1つのオブジェクトとして丸ごと差し替える (スレッド間で中途半端な状態を見せない)
+LeftContext = namedtuple("LeftContext", ["words", "state", "text"])
+
+
+
+class PredictionCancelled(Exception):
+    """予測が取り消された (同じセッションの新しい入力に置き換えられた) ときに送出する"""
+
+
+# マッピング定義 (キー -> そのキーを担当する指で打つ文字)
+QWERTY_MAP = {
+    '1': "qaz",# 左小指
+    '2': "wsx",# 左薬指
+    '3': "edc",# 左中指
+    '4': "tgbrfv",# 左人差し指
+    '7': "yhnujm",# 右人差し指
+    '8': "ik",# 右中指
+    '9': "ol",# 右薬指
+    '0': "p",# 右小指
+}
+# 逆引きマップ
+REVERSE_QWERTY_MAP = {char: key for key, chars in QWERTY_MAP.items() for char in chars}
+
+
+def select_top(scores, width, method="partition"):
+    """
+    スコア配列から上位width件のインデックスをスコア降順で返す
+    同じスコアはインデックスの小さい順に並べ、width件目と同点のものもインデックスの小さいものを残す
+    (どの method でも全件ソートの安定ソートと同じ結果になる)。
+    :param scores: array('d') などのスコア列
+    :param method: "partition" : numpy.argpartition で選択してから上位だけソート
+                   "heap"      : heapq.nlargest (widthが候補数より十分小さいとき向き)
+                   "sort"      : 全件ソート (旧実装と同じ)
+    """
+    n = len(scores)
+    if method == "sort":
+        return sorted(range(n), key=scores.__getitem__, reverse=True)[:width]
+    if method == "heap":
+        return heapq.nlargest(width, range(n), key=scores.__getitem__)
+
+    arr = np.frombuffer(scores, dtype=np.float64) if isinstance(scores, array) else np.asarray(scores, dtype=np.float64)
+    if n > width:
+        # argpartition は境界の同点をどれでも選ぶので、境界のスコアだけ求めて選び直す
+        # (未知語の候補は同じスコアになるので、境界に同点が並ぶのが普通)
+        threshold = -np.partition(-arr, width - 1)[width - 1]
+        above = np.flatnonzero(arr > threshold)
+        ties = np.flatnonzero(arr == threshold)[:width - len(above)]
+        top = np.sort(np.concatenate((above, ties)))
+        order = top[np.argsort(-arr[top], kind="stable")]
+    else:
+        order = np.argsort(-arr, kind="stable")
+    return order.tolist()
+
+
+def memory_usage():
+    """
+    このプロセスのメモリ使用量 [MB]
+    rss_mb     : 物理メモリ上のページ全体 (mmap したモデルのページも含む)
+    private_mb : このプロセスだけが持つページ (read で読み込んだモデルはこちらに入る)
+    shared_mb  : 他のプロセスと共有しているページ (mmap したモデルはページキャッシュとして共有される)
+    Linux 以外では取得できない項目は None
+    """
+    usage = {"rss_mb": None, "private_mb": None, "shared_mb": None}
+    fields = {"Rss:": "rss_mb", "Private_Clean:": "private_mb", "Private_Dirty:": "private_mb",
+              "Shared_Clean:": "shared_mb", "Shared_Dirty:": "shared_mb"}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                key = fields.get(parts[0]) if parts else None
+                if key is not None:
+                    usage[key] = round((usage[key] or 0) + int(parts[1]) / 1024, 1)
+    except OSError:
+        pass
+    return usage
+
+
+def _diff(after, before):
+    return None if after is None or before is None else round(after - before, 1)
+
+
+class Beam:
+    """
+    ビーム (仮説の集合)
+    (score, word) のタプルを仮説ごとに作らず、単語のリストとスコアの配列 (float64, 降順) の組で持つ。
+    1ステップで width × 6 件の候補が出るので、タプルと float オブジェクトを作らないだけで
+    割り当てと GC の負担が大きく減る。(score, word) の形にするのは最後に返す上位 limit 件だけ。
+
+    KenLM は単語トークンのモデルで、採点には候補の文字列そのものが要るので、
+    単語は親へのポインタと文字コードではなく文字列のまま持つ。
+    キャッシュなどで共有されるので、呼び出し側で書き換えないこと。
+    """
+    __slots__ = ("words", "scores")
+
+    def __init__(self, words, scores):
+        self.words = words
+        self.scores = scores
+
+    @classmethod
+    def initial(cls):
+        """探索開始時のビーム (空文字列1件)"""
+        return cls([""], np.zeros(1))
+
+    def __len__(self):
+        return len(self.words)
+
+    def head(self, n):
+        """上位 n 件"""
+        return Beam(self.words[:n], self.scores[:n])
+
+    def top(self, limit=None):
+        """上位 limit 件を (score, word) のリストにする (None なら全件)"""
+        return list(zip(self.scores[:limit].tolist(), self.words[:limit]))
+
 
 class WordPredictor:
-    def __init__(self, model_path='wiki_en_token.arpa.bin'):
+    """
+    単語予測器 (モデル・索引などの共有部分)
+
+    モデル・語彙索引・キー対応表は読み取り専用で、全セッションから共有する。
+    入力中のキー列・左文脈・ビームのキャッシュなどの可変状態は
+    PredictionSession に分けてあり、session(ID) でセッションごとに取得する。
+    (従来の set_text_input / predict_* などは既定セッションに対する操作として残してある)
+    """
+    DECODERS = ("state", "legacy")
+    # この秒数使われていないセッションは破棄する (SESSION_SWEEP_SECONDS ごとに、セッションの参照時に確認する)
+    SESSION_IDLE_SECONDS = 60 * 60
+    SESSION_SWEEP_SECONDS = 60
+    # 同時に保持するセッション数の上限 (既定セッションを除く)。超えたら最後に使われたのが古いものから破棄する。
+    # ビームのキャッシュの上限 cache_max_bytes は全セッションの合計で、セッションごとに均等に割り当てる
+    MAX_SESSIONS = 8
+    # 自動ビーム幅 (beam_width="auto"):
+    # 各ステップで最良スコアから ADAPTIVE_MARGIN (log10) 以内の仮説だけを残し、
+    # 残す件数は [ADAPTIVE_MIN_WIDTH, ADAPTIVE_MAX_WIDTH] に収める
+    ADAPTIVE_MIN_WIDTH = 200
+    ADAPTIVE_MAX_WIDTH = 10000
+    ADAPTIVE_MARGIN = 4.0
+    # 時間予算 (deadline) での幅の見積もりに使う、仮説1件あたりの展開時間の平滑化:
+    # 仮説が COST_MIN_HYPOTHESES 件以上のステップの実測値だけを指数移動平均 (係数 COST_SMOOTHING) で取り込む。
+    # 仮説1件だけの最初のステップなどは固定の処理時間が大半で、1件あたりに直すと大きく見積もりすぎるため
+    COST_MIN_HYPOTHESES = 50
+    COST_SMOOTHING = 0.2
+
+    def __init__(self, model_path='wiki_en_token.arpa.bin', decoder="state",
+                 cache_max_bytes=64 * 1024 * 1024, prune="partition", lexicon=None, table=None,
+                 vocabulary=None, load_method="populate", shared_cache=None):
         """
         初期化
-        :param model_path: KenLMのモデルファイルパス
+        :param model_path: 言語モデル。KenLMのモデルファイルパス、文字n-gramモデル (build_char_ngram.py で作成した .npz) のパス、
+                           または kenlm.Model と同じ採点インターフェース (order / State / BeginSentenceWrite /
+                           BaseScore / score) を持つオブジェクト。score_extensions(in_state, parents, parent_scores, chars)
+                           も持っていれば、"state" デコーダはそれでビームの1ステップをまとめて採点する
+        :param load_method: KenLM のモデルの読み込み方法 (LOAD_METHODS 参照)
+        :param decoder: ビームサーチのエンジン
+                        "state"  : 状態 (kenlm.State) を使い BaseScore で採点 (既定)
+                        "legacy" : 候補ごとに model.score() を呼ぶ旧実装
+        :param cache_max_bytes: ビームの途中経過キャッシュの上限 (概算byte, 0で無効)。全セッションの合計で、
+                                各セッション (既定セッションを含む) は cache_max_bytes / (MAX_SESSIONS + 1) まで使う
+        :param prune: "state" デコーダで上位width件を選ぶ方法 (PRUNE_METHODS 参照)
+        :param lexicon: 語彙制約モード。索引ファイル (.kidx) か語彙ファイル (words.json / .arpa / 1行1単語) のパス、
+                        または KeySequenceIndex。指定すると実在する単語 (の先頭部分) だけを採点する
+        :param table: 短いキー列の予測表 (build_prediction_table.py で作成した .ptab) のパス、
+                      または PredictionTable。文頭での短いキー列は探索せずに表を引く
+        :param vocabulary: モデルの語彙の索引 (モデルの ARPA から build_key_index.py で作成した .kidx) のパス、
+                           または KeySequenceIndex。指定すると "state" デコーダは各ステップの候補を
+                           NumPy でまとめて採点する (語彙外の候補は KenLM を呼ばずに <unk> のスコアにする)
+        :param shared_cache: プロセス間で共有する予測結果のキャッシュ (SQLite のファイルパス、
+                             または SharedPredictionCache)。モデルはファイルパスで指定すること
         """
-        self.qwerty_combinations = 0
+        if decoder not in self.DECODERS:
+            raise ValueError(f"未知のdecoderです: {decoder} (選択肢: {self.DECODERS})")
+        if prune not in PRUNE_METHODS:
+            raise ValueError(f"未知のpruneです: {prune} (選択肢: {PRUNE_METHODS})")
+        if load_method not in LOAD_METHODS:
+            raise ValueError(f"未知のload_methodです: {load_method} (選択肢: {tuple(LOAD_METHODS)})")
+        self.decoder = decoder
+        self.prune = prune
+        self.cache_max_bytes = cache_max_bytes
+        self.session_cache_max_bytes = cache_max_bytes // (self.MAX_SESSIONS + 1)
+        self.load_method = load_method
+        # 仮説1件あたりの展開時間 [s] の平滑化した推定値 (未計測なら None)。全セッションで共有する
+        self.hypothesis_cost = None
+        # 読み込みにかかった時間と、読み込みで増えたメモリ (/readyz やログで報告する)
+        memory_before = memory_usage()
+        start = time.perf_counter()
+        self.model = self._load_model(model_path)
+        self.load_seconds = time.perf_counter() - start
+        self.load_memory = {key: _diff(memory_usage().get(key), value) for key, value in memory_before.items()}
+        # 状態のクラス (KenLM 以外のモデルは自前の State を持つ)
+        self.State = getattr(self.model, "State", kenlm.State)
+
+        # 文頭 (<s>) の状態は不変なので一度だけ作っておく
+        self._bos_state = self.State()
+        self.model.BeginSentenceWrite(self._bos_state)
+        self._bos_context = LeftContext((), self._bos_state, "")
+
+        # マッピング定義
+        self.QWERTY_MAP = QWERTY_MAP
+        # 逆引きマップ
+        self.REVERSE_QWERTY_MAP = REVERSE_QWERTY_MAP
+
+        # 語彙制約モード用の索引 (キー列 -> 単語)
+        # .kidx (build_key_index.py で作成) は mmap で遅延オープンされる
+        if isinstance(lexicon, str):
+            lexicon = open_index(lexicon, self.REVERSE_QWERTY_MAP)
+        self.lexicon = lexicon
+
+        # モデルの語彙の索引 (まとめて採点する経路用)。語彙が足りないと結果が変わるので、モデルの ARPA から作ること
+        if vocabulary is not None and not isinstance(self.model, kenlm.Model):
+            raise ValueError("vocabulary は単語トークンの KenLM モデルでのみ使えます")
+        if isinstance(vocabulary, str):
+            vocabulary = open_index(vocabulary, self.REVERSE_QWERTY_MAP)
+        self.vocabulary = vocabulary
+
+        # 短いキー列の予測表 (文頭のみ)。作成時と異なるモデル・デコーダでは使わない
+        if isinstance(table, str):
+            table = PredictionTable(table, self.QWERTY_MAP)
+        if table is not None:
+            self._check_table(table, model_path)
+        self.table = table
+
+        # プロセス間で共有する予測結果のキャッシュ。キーにモデルの識別子 (ファイル名・サイズ・更新時刻) と
+        # デコーダのバージョン・設定を含める
+        if shared_cache is not None and not isinstance(model_path, str):
+            raise ValueError("shared_cache はモデルをファイルパスで指定したときのみ使えます")
+        if isinstance(shared_cache, str):
+            shared_cache = SharedPredictionCache(shared_cache)
+        self.shared_cache = shared_cache
+        if shared_cache is not None:
+            stat = os.stat(model_path)
+            self._shared_namespace = (f"{os.path.basename(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+                                      f"|v{DECODER_VERSION}|{self.decoder}|{self.prune}|{self.ADAPTIVE_MIN_WIDTH}"
+                                      f"|{self.ADAPTIVE_MAX_WIDTH}|{self.ADAPTIVE_MARGIN}")
+
+        # セッションID -> PredictionSession
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._next_sweep = time.monotonic() + self.SESSION_SWEEP_SECONDS
+        self.default_session = PredictionSession(self, None)
+
+    def _load_model(self, model_path):
+        """
+        言語モデルを読み込む
+        文字n-gramモデル (.npz) はそのまま読み込み、KenLM のモデルが無ければ get_model.sh で取得する。
+        """
+        if not isinstance(model_path, str):
+            return model_path
+        if model_path.endswith(CHAR_NGRAM_SUFFIX):
+            print(f"[Predictor] Loading character n-gram model: {model_path} ...")
+            model = CharNgramModel.load(model_path)
+            print(f"[Predictor] Model loaded. (order={model.order})")
+            return model
+
         if not os.path.exists(model_path):
             print(f"[Predictor] モデルが見つかりません: {model_path}")
             print("[Predictor] get_model.sh を実行してモデルを取得します...")
@@ -26,61 +306,168 @@ class WordPredictor:
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"モデルファイルが見つかりません: {model_path}")
         
-        print(f"[Predictor] Loading model: {model_path} ...")
-        self.model = kenlm.LanguageModel(model_path)
-        print("[Predictor] Model loaded.")
+        print(f"[Predictor] Loading model: {model_path} (load_method={self.load_method}) ...")
+        config = kenlm.Config()
+        config.load_method = LOAD_METHODS[self.load_method]
+        start = time.perf_counter()
+        model = kenlm.LanguageModel(model_path, config)
+        memory = memory_usage()
+        print(f"[Predictor] Model loaded in {time.perf_counter() - start:.2f}s "
+              f"(RSS {memory['rss_mb']} MB, private {memory['private_mb']} MB)")
+        return model
 
-        # 現在入力中のインデックス列を保持するバッファ
-        self.current_index_sequence = ""
+    def _check_table(self, table, model_path):
+        info = table.meta.get("info", {})
+        if info.get("decoder", self.decoder) != self.decoder:
+            raise ValueError(f"予測表は decoder={info['decoder']} で作成されています: {table.path}")
+        if (isinstance(model_path, str) and "model_bytes" in info
+                and info["model_bytes"] != os.path.getsize(model_path)):
+            raise ValueError(f"予測表の作成に使ったモデルと現在のモデルが異なります: {table.path}")
+        print(f"[Predictor] Prediction table loaded: {table.path} "
+              f"(max_length={table.max_length}, top_k={table.top_k})")
 
-        # マッピング定義
-        self.QWERTY_MAP = {
-            '1': "qaz",# 左小指
-            '2': "wsx",# 左薬指
-            '3': "edc",# 左中指
-            '4': "tgbrfv",# 左人差し指
-            '7': "yhnujm",# 右人差し指
-            '8': "ik",# 右中指
-            '9': "ol",# 右薬指
-            '0': "p",# 右小指
-        }
-        # 逆引きマップ
-        self.REVERSE_QWERTY_MAP = {char: key for key, chars in self.QWERTY_MAP.items() for char in chars}
+    # =========================================================
+    #  セッション管理
+    # =========================================================
+
+    def session(self, session_id=None):
+        """
+        セッションIDに対応する PredictionSession を返す (無ければ作る)
+        参照は dict を引くだけでロックを取らない。ロックは新規作成時と、
+        SESSION_SWEEP_SECONDS ごとの使われていないセッションの破棄のときのみ。
+        """
+        if session_id is None:
+            return self.default_session
+        if time.monotonic() >= self._next_sweep:
+            with self._sessions_lock:
+                self._drop_idle_sessions()
+        session = self._sessions.get(session_id)
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(session_id)
+                if session is None:
+                    self._drop_idle_sessions()
+                    while len(self._sessions) >= self.MAX_SESSIONS:
+                        oldest = min(self._sessions, key=lambda sid: self._sessions[sid].last_used)
+                        del self._sessions[oldest]
+                    session = PredictionSession(self, session_id)
+                    self._sessions[session_id] = session
+        session.last_used = time.monotonic()
+        return session
+
+    def drop_session(self, session_id):
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
+
+    def _drop_idle_sessions(self):
+        """使われていないセッションを破棄する (_sessions_lock を持って呼ぶこと)"""
+        now = time.monotonic()
+        self._next_sweep = now + self.SESSION_SWEEP_SECONDS
+        deadline = now - self.SESSION_IDLE_SECONDS
+        for session_id in [sid for sid, s in self._sessions.items() if s.last_used < deadline]:
+            del self._sessions[session_id]
+
+    def warm_up(self, phrases, beam_width=10000, limit=10, latency_budget_ms=None):
+        """
+        起動直後の予測を速くするための空打ち
+        フレーズを1キーずつ入力したのと同じ順に予測して、モデル・索引・予測表の
+        mmap されたページや NumPy の初期化などを先に済ませておく。
+        使い捨てのセッションで行うので、実際のセッションの状態には影響しない。
+        :param phrases: 単語列の文字列のリスト
+        :return: 予測した回数
+        """
+        session = PredictionSession(self, None)
+        count = 0
+        for phrase in phrases:
+            committed = []
+            for word in phrase.lower().split():
+                for length in range(1, len(word) + 1):
+                    session.predict_text(word[:length], context=committed, limit=limit,
+                                         beam_width=beam_width, latency_budget_ms=latency_budget_ms)
+                    count += 1
+                committed.append(word)
+        return count
 
     # =========================================================
-    #  入力処理メソッド
+    #  入力処理メソッド (既定セッションに対する操作)
     # =========================================================
 
     def handle_index_input(self, index_val: int):
-        if 0 <= index_val <= 7: # キーマップに合わせて適宜調整
-             # 注意: 上記QWERTY_MAPのキーは文字列の '0'~'9' ですが、
-             # handle_index_inputの引数がintの場合の変換はシステム全体で整合性をとってください。
-             # ここでは簡易的にstr変換して追加します
-            self.current_index_sequence += str(index_val)
-            self.qwerty_combinations = self.count_qwerty_combinations(self.current_index_sequence)
-            print(f"[Predictor] updated index seq: {self.current_index_sequence}")
-        else:
-            print(f"[Predictor] Invalid index input: {index_val}")
+        self.default_session.handle_index_input(index_val)
 
     def handle_backspace(self):
-        if len(self.current_index_sequence) > 0:
-            self.current_index_sequence = self.current_index_sequence[:-1]
-            self.qwerty_combinations = self.count_qwerty_combinations(self.current_index_sequence)
+        self.default_session.handle_backspace()
 
     def clear(self):
-        self.current_index_sequence = ""
-        self.qwerty_combinations = 0
+        self.default_session.clear()
 
     def set_text_input(self, text: str):
+        self.default_session.set_text_input(text)
+
+    def get_current_sequence(self):
+        return self.default_session.current_index_sequence
+
+    def set_context(self, words):
+        self.default_session.set_context(words)
+
+    @property
+    def current_index_sequence(self):
+        return self.default_session.current_index_sequence
+
+    @property
+    def qwerty_combinations(self):
+        return self.default_session.qwerty_combinations
+
+    @property
+    def context_words(self):
+        return self.default_session.context.words
+
+    @property
+    def frontier_cache(self):
+        return self.default_session.frontier_cache
+
+    def text_to_sequence(self, text: str) -> str:
         indices = []
         for char in text.lower():
             if char in self.REVERSE_QWERTY_MAP:
                 indices.append(self.REVERSE_QWERTY_MAP[char])
-        self.current_index_sequence = "".join(indices)
-        self.qwerty_combinations = self.count_qwerty_combinations(self.current_index_sequence)
+        return "".join(indices)
 
-    def get_current_sequence(self):
-        return self.current_index_sequence
+    def extend_context(self, context, words):
+        """
+        context に words を読み進めた LeftContext を返す
+        words が context.words の続きなら、追加分だけを読み進める。
+        :param context: 元の LeftContext (None なら文頭)
+        """
+        if context is None:
+            context = self._bos_context
+        words = tuple(w.strip().lower() for w in (words or []) if w and w.strip())
+        if words == context.words:
+            return context
+
+        if words[:len(context.words)] == context.words:
+            state, new_words = context.state, words[len(context.words):]
+        else:
+            state, new_words = self._bos_state, words
+
+        for word in new_words:
+            out_state = self.State()
+            self.model.BaseScore(state, word, out_state)
+            state = out_state
+
+        return LeftContext(words, state, " ".join(words) + " " if words else "")
+
+    def score_word(self, word, context=None):
+        """文脈に続く1語 (入力途中でもよい) のスコア。ビームと同じ基準で採点する"""
+        if context is None:
+            context = self._bos_context
+        if self.decoder == "legacy":
+            return self.model.score(context.text + word)
+        return self.model.BaseScore(context.state, word, self.State())
+
+    def context_key(self, context):
+        """キャッシュのキーに使う文脈 (モデルが参照する直近 order-1 語だけで十分)"""
+        return context.words[-(self.model.order - 1):] if self.model.order > 1 else ()
 
     # =========================================================
     #  予測ロジック
@@ -90,54 +477,520 @@ class WordPredictor:
         """
         VRChat用など、文字列リストだけ欲しい場合に使用
         """
-        if not self.current_index_sequence:
-            return []
-        top_candidates = self._beam_search(self.current_index_sequence, beam_width)
-        return [word for score, word in top_candidates[:limit]]
+        return self.default_session.predict_top_words(limit, beam_width)
 
     def predict_top_words_with_scores(self, limit=6, beam_width=100000):
         """
         WEB UI用。スコア情報も含めて返す。
         :return: [{"word": str, "score": float}, ...]
         """
-        if not self.current_index_sequence:
+        return self.default_session.predict_top_words_with_scores(limit, beam_width)
+
+    def decode(self, index_seq, width, context=None, cache=None, latency_budget_ms=None, limit=None,
+               cancel=None):
+        """
+        予測候補を求める。語彙制約モードなら索引の候補だけを採点し、
+        索引に候補が無いキー列 (未登録語) のときはビームサーチに切り替える。
+        文頭の短いキー列は、予測表があれば探索せずに表の結果 (上位 table.top_k 件) を返す。
+        ビームサーチの結果は、共有キャッシュがあればそこから引き、無ければ計算して登録する
+        (limit を指定したときのみ。時間切れで幅を絞った結果は登録しない)。
+        共有キャッシュから引いたときも、cache のビームが1ステップ前まであれば1ステップ進めて登録しておく
+        (次のキー入力で共有キャッシュに無かったときに、最初から探索し直さなくて済むように)。
+        状態は引数で受け取るだけで self を書き換えないので、複数スレッドから同時に呼べる。
+        :param width: ビーム幅 (int) または ADAPTIVE_WIDTH ("auto")
+        :param context: LeftContext (None なら文頭)
+        :param cache: ビームの途中経過を再利用する FrontierCache (None なら使わない)
+        :param latency_budget_ms: 1回の予測にかけてよい時間。超えたら残りのステップは
+                                  ADAPTIVE_MIN_WIDTH まで幅を絞って打ち切りを早める
+        :param limit: 返す件数 (None ならビーム全体)
+        :param cancel: threading.Event。セットされたらビームサーチをステップの区切りで止めて PredictionCancelled を送出する
+                       (それまでのステップのビームはキャッシュに残るので、次の入力で再利用される)
+        :return: (score, word) のリスト (スコア降順)
+        """
+        if context is None:
+            context = self._bos_context
+        if self.lexicon is not None:
+            candidates = self._lexicon_search(index_seq, width, context)
+            if candidates:
+                return candidates[:limit]
+        candidates = self._table_lookup(index_seq, context)
+        if candidates is not None:
+            return candidates[:limit]
+
+        shared_key = None
+        if self.shared_cache is not None and limit is not None:
+            shared_key = SharedPredictionCache.make_key(self._shared_namespace, index_seq,
+                                                        self.context_key(context), width, limit)
+            candidates = self.shared_cache.get(shared_key)
+            if candidates is not None:
+                if cache is not None:
+                    self._extend_frontier(index_seq, width, context, cache, cancel)
+                return candidates
+
+        deadline = None
+        if latency_budget_ms is not None:
+            deadline = time.perf_counter() + latency_budget_ms / 1000
+        beam, degraded = self._beam_search(index_seq, width, context, cache, deadline, cancel)
+        candidates = beam.top(limit)
+        if shared_key is not None and not degraded:
+            self.shared_cache.put(shared_key, candidates)
+        return candidates
+
+    def predict_many(self, index_sequences, limit=6, beam_width=10000, contexts=None):
+        """
+        複数のキー列をまとめて予測する (評価スクリプトやフレーズの一括再生用)
+        同じ文脈のキー列はプレフィックス木にまとめ、共通のプレフィックスは1回だけ展開する。
+        :param index_sequences: キー列のリスト
+        :param contexts: 各キー列の左文脈 (単語のリスト) のリスト。None なら全て文頭
+        :return: 入力と同じ順の予測結果リスト [[{"word", "score"}, ...], ...]
+        """
+        if contexts is None:
+            contexts = [None] * len(index_sequences)
+        if len(contexts) != len(index_sequences):
+            raise ValueError("contexts の長さが index_sequences と一致しません")
+
+        # 文脈ごとに重複を除いたキー列を集める
+        groups = {}
+        for index_seq, words in zip(index_sequences, contexts):
+            key = tuple(w.strip().lower() for w in (words or []) if w and w.strip())
+            groups.setdefault(key, set()).add(index_seq)
+
+        decoded = {}
+        for words, sequences in groups.items():
+            context = self.extend_context(None, words)
+            pending = []
+            for index_seq in sequences:
+                candidates = []
+                if index_seq and self.lexicon is not None:
+                    candidates = self._lexicon_search(index_seq, beam_width, context)
+                if index_seq and not candidates:
+                    candidates = self._table_lookup(index_seq, context)
+                if candidates or not index_seq:
+                    decoded[(words, index_seq)] = candidates or []
+                else:
+                    pending.append(index_seq)
+            for index_seq, beam in self._beam_search_many(pending, beam_width, context).items():
+                decoded[(words, index_seq)] = beam.top(limit)
+
+        results = []
+        for index_seq, words in zip(index_sequences, contexts):
+            key = tuple(w.strip().lower() for w in (words or []) if w and w.strip())
+            top_candidates = decoded[(key, index_seq)]
+            results.append([{"word": word, "score": score} for score, word in top_candidates[:limit]])
+        return results
+
+    def _table_lookup(self, index_seq, context):
+        """予測表で引けるキー列 (文頭・表の最大長以下) なら表の結果を、それ以外は None を返す"""
+        if self.table is None or context.words:
+            return None
+        return self.table.lookup(index_seq)
+
+    def _beam_search_many(self, index_sequences, width, context):
+        """
+        キー列の集合をプレフィックス木にして深さ優先でビームサーチする
+        各ノードのビームは親のビームを1ステップ進めて作るので、共通のプレフィックスは1回だけ計算する。
+        保持するビームは木の深さ分だけで済む。
+        :return: {キー列: Beam}
+        """
+        step = self._step_function()
+
+        # プレフィックス木 (子の dict。終端は None キーで表す)
+        trie = {}
+        for index_seq in index_sequences:
+            node = trie
+            for i_char in index_seq:
+                node = node.setdefault(i_char, {})
+            node[None] = index_seq
+
+        results = {}
+        stack = [(trie, Beam.initial())]
+        while stack:
+            node, hypotheses = stack.pop()
+            for i_char, child in node.items():
+                if i_char is None:
+                    results[child] = hypotheses
+                    continue
+                if i_char in self.QWERTY_MAP:
+                    child_hypotheses = self._advance(step, hypotheses, self.QWERTY_MAP[i_char], width, context)
+                else:
+                    # マッピングになければスキップ
+                    child_hypotheses = hypotheses
+                stack.append((child, child_hypotheses))
+        return results
+
+    def _lexicon_search(self, index_seq, width, context):
+        """
+        語彙制約デコード
+        キー列で始まる実在の単語の先頭部分 (入力と同じ長さ) だけを言語モデルで採点する。
+        :return: (score, word) のリスト (スコア降順、上位width件)
+        """
+        words = self.lexicon.prefixes(index_seq)
+        if not words:
             return []
-        
-        top_candidates = self._beam_search(self.current_index_sequence, beam_width)
-        
-        # UI表示用に整形して返す
-        return [{"word": word, "score": score} for score, word in top_candidates[:limit]]
+        if width == ADAPTIVE_WIDTH:
+            width = self.ADAPTIVE_MAX_WIDTH
+
+        if self.decoder == "legacy":
+            context_text = context.text
+            scores = array('d', (self.model.score(context_text + word) for word in words))
+        else:
+            base_score = self.model.BaseScore
+            context_state = context.state
+            out_state = self.State()
+            scores = array('d', (base_score(context_state, word, out_state) for word in words))
+
+        return [(scores[i], words[i]) for i in select_top(scores, width, self.prune)]
+
+    def _step_function(self):
+        """設定に応じたビームサーチ1ステップの実装を返す"""
+        if self.decoder == "legacy":
+            return self._beam_step_legacy
+        if self.vocabulary is not None:
+            return self._beam_step_batch
+        if hasattr(self.model, "score_extensions"):
+            return self._beam_step_extend
+        return self._beam_step_state
 
-    def _beam_search(self, index_seq, width):
+    def _beam_search(self, index_seq, width, context, cache, deadline=None, cancel=None):
         """
         ビームサーチ本体
-        :return: (score, word) のリスト (スコア降順)
+        キャッシュ済みで最も長いプレフィックスのビームから探索を再開し、
+        1ステップ進めるごとにその時点のビームをキャッシュへ登録する。
+        deadline (time.perf_counter() の値) があるときは、仮説1件あたりの展開時間の推定値
+        (hypothesis_cost) から残りのステップが間に合う幅を見積もり、それより広ければ幅を絞る。
+        候補が実際にその幅を超えて切り捨てられたビームは通常と結果が変わるので、それ以降のステップはキャッシュしない。
+        :return: (Beam, 幅を絞ったことで結果が変わったかどうか)
         """
-        current_hypotheses = [(0.0, "")]
+        step = self._step_function()
+
+        start, current_hypotheses = 0, None
+        if cache is not None:
+            namespace = self._frontier_namespace(width, context)
+            start, current_hypotheses = cache.lookup(namespace, index_seq)
+        if current_hypotheses is None:
+            current_hypotheses = Beam.initial()
 
-        for i_char in index_seq:
+        full_width = self.ADAPTIVE_MAX_WIDTH if width == ADAPTIVE_WIDTH else width
+        degraded = False
+        for pos in range(start, len(index_seq)):
+            i_char = index_seq[pos]
             # マッピングになければスキップ
             if i_char not in self.QWERTY_MAP:
-                continue # あるいは return []
-
+                continue
+            if cancel is not None and cancel.is_set():
+                raise PredictionCancelled(index_seq)
             possible_chars = self.QWERTY_MAP[i_char]
-            next_hypotheses = []
+            cap = None
+            if deadline is not None:
+                cap = self._budget_width(deadline, len(index_seq) - pos - 1,
+                                         len(current_hypotheses), self.hypothesis_cost)
+                if cap is not None and cap >= full_width:
+                    cap = None
+
+            step_start = time.perf_counter()
+            next_hypotheses = self._advance(step, current_hypotheses, possible_chars,
+                                            width, context, cap)
+            self._record_cost(time.perf_counter() - step_start, len(current_hypotheses))
+            # 上限で実際に候補が切り捨てられたときだけ、結果が通常と変わる
+            # (自動ビーム幅で、しきい値で残る件数が上限より少なければ、上限が無くても同じ結果になる)
+            if (cap is not None and len(current_hypotheses) * len(possible_chars) > cap
+                    and len(next_hypotheses) >= cap):
+                degraded = True
+            current_hypotheses = next_hypotheses
+            if cache is not None and not degraded:
+                cache.store(namespace, index_seq[:pos + 1], current_hypotheses)
+
+        return current_hypotheses, degraded
+
+    def _record_cost(self, seconds, n_hypotheses):
+        """1ステップの所要時間を、仮説1件あたりの展開時間の推定値に取り込む"""
+        if n_hypotheses < self.COST_MIN_HYPOTHESES:
+            return
+        cost = seconds / n_hypotheses
+        previous = self.hypothesis_cost
+        self.hypothesis_cost = cost if previous is None else previous + self.COST_SMOOTHING * (cost - previous)
+
+    def _frontier_namespace(self, width, context):
+        """FrontierCache の名前空間 (結果が変わる設定と文脈)"""
+        return (self.decoder, self.prune, width, self.context_key(context))
+
+    def _extend_frontier(self, index_seq, width, context, cache, cancel=None):
+        """
+        cache のビームが index_seq の1ステップ前まであれば、1ステップ進めて登録する
+        (キー入力ごとに探索を続けるのと同じ負荷。それより前で途切れていれば何もせず、次に探索するときに任せる)
+        """
+        start, _ = cache.lookup(self._frontier_namespace(width, context), index_seq)
+        if len(index_seq) - 1 <= start < len(index_seq):
+            self._beam_search(index_seq, width, context, cache, None, cancel)
+
+    def _budget_width(self, deadline, steps_after, n_hypotheses, cost_per_hypothesis):
+        """
+        残り時間で残りのステップを終えられるビーム幅を見積もる
+        :param steps_after: このステップの後に残っているステップ数
+        :param n_hypotheses: このステップで展開する仮説数
+        :param cost_per_hypothesis: 仮説1件あたりの展開時間の推定値 (未計測なら None)
+        :return: 幅の上限 (制限不要なら None)
+        """
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return self.ADAPTIVE_MIN_WIDTH
+        if cost_per_hypothesis is None or steps_after == 0:
+            return None
+        # このステップの分を差し引いた残りを、後のステップに均等に割り振る
+        per_step = (remaining - n_hypotheses * cost_per_hypothesis) / steps_after
+        return max(self.ADAPTIVE_MIN_WIDTH, int(per_step / cost_per_hypothesis))
+
+    def _advance(self, step, current_hypotheses, possible_chars, width, context, cap=None):
+        """
+        ビームを1ステップ進める
+        自動ビーム幅のときは ADAPTIVE_MAX_WIDTH 件まで展開したあと、
+        最良スコアとの差 (log10) が ADAPTIVE_MARGIN 以内のものだけを残す。
+        明らかに見込みの無い仮説が多いステップでは幅が縮み、
+        スコアが拮抗しているステップでは幅が広がる。
+        """
+        adaptive = width == ADAPTIVE_WIDTH
+        if adaptive:
+            width = self.ADAPTIVE_MAX_WIDTH
+        if cap is not None:
+            width = min(width, cap)
+
+        next_hypotheses = step(current_hypotheses, possible_chars, width, context)
+        if not adaptive or len(next_hypotheses) <= self.ADAPTIVE_MIN_WIDTH:
+            return next_hypotheses
+
+        # スコア降順に並んでいるので、しきい値以下になる最初の位置を二分探索する
+        threshold = next_hypotheses.scores[0] - self.ADAPTIVE_MARGIN
+        keep = int(np.searchsorted(-next_hypotheses.scores, -threshold, side="left"))
+        return next_hypotheses.head(max(keep, self.ADAPTIVE_MIN_WIDTH))
+
+    def _beam_step_state(self, current_hypotheses, possible_chars, width, context):
+        """
+        kenlm.State ベースのビームサーチ1ステップ
+        単語トークンのモデルなので、入力途中の文字列も1トークンとして扱われる。
+        各候補は左文脈の状態 (文脈が無ければ文頭 <s>) から BaseScore を1回引くだけで採点する。
+        入力途中の単語は文末ではないので </s> は付けない。
+        :return: Beam (スコア降順、上位width件)
+        """
+        base_score = self.model.BaseScore
+        context_state = context.state
+        # 出力用の State は使い回す (候補ごとに確保しない)
+        out_state = self.State()
+
+        # 候補は単語のリストとスコアの配列に溜める (タプルは作らない)
+        words = [word + char for word in current_hypotheses.words for char in possible_chars]
+        scores = array('d', [base_score(context_state, word, out_state) for word in words])
+
+        # 全件ソートせず、上位width件だけを選択する
+        order = select_top(scores, width, self.prune)
+        return Beam([words[i] for i in order], np.frombuffer(scores)[order])
+
+    def _beam_step_batch(self, current_hypotheses, possible_chars, width, context):
+        """
+        語彙の索引を使い、ビーム全体を1ステップまとめて展開・採点する
+        単語トークンのモデルでは、語彙に無い文字列はすべて <unk> と同じスコアになる。
+        そこで全候補 (親の仮説 × 文字) のスコア配列を <unk> のスコアで埋めておき、
+        このキー列になる語彙の単語の位置だけ BaseScore で書き換える。
+        候補の文字列は作らず「親の番号 × 文字数 + 文字の番号」で表し、
+        上位width件に残ったものだけ単語にするので、_beam_step_state と同じ結果を
+        KenLM の呼び出しと文字列の生成をほとんどせずに求められる。
+        :return: Beam (スコア降順、上位width件)
+        """
+        base_score = self.model.BaseScore
+        context_state = context.state
+        out_state = self.State()
+        parents = current_hypotheses.words
+        n_chars = len(possible_chars)
+
+        scores = np.full(len(parents) * n_chars, base_score(context_state, "<unk>", out_state))
+
+        # ビーム内の単語はすべて同じキー列なので、先頭の仮説からこのステップまでのキー列が分かる
+        index_seq = self.text_to_sequence(parents[0]) + self.REVERSE_QWERTY_MAP[possible_chars[0]]
+        known_words = self.vocabulary.words(index_seq)
+        if known_words:
+            parent_pos = dict(zip(parents, range(len(parents))))
+            char_pos = {char: j for j, char in enumerate(possible_chars)}
+            for word in known_words:
+                i = parent_pos.get(word[:-1])
+                if i is not None:
+                    scores[i * n_chars + char_pos[word[-1]]] = base_score(context_state, word, out_state)
+
+        order = np.asarray(select_top(scores, width, self.prune), dtype=np.intp)
+        parent_idx, char_idx = np.divmod(order, n_chars)
+        words = [parents[i] + possible_chars[j] for i, j in zip(parent_idx.tolist(), char_idx.tolist())]
+        return Beam(words, scores[order])
+
+    def _beam_step_extend(self, current_hypotheses, possible_chars, width, context):
+        """
+        文字単位のモデル (score_extensions を持つもの) 用のビームサーチ1ステップ
+        候補のスコアは「親のスコア + 次の文字の確率」なので、モデルに親の仮説とスコアを渡して
+        全候補をまとめて採点させる。候補の文字列は上位width件に残ったものだけ作る。
+        :return: Beam (スコア降順、上位width件)
+        """
+        parents = current_hypotheses.words
+        n_chars = len(possible_chars)
+        scores = self.model.score_extensions(context.state, parents, current_hypotheses.scores, possible_chars)
 
-            for score, word in current_hypotheses:
-                for char in possible_chars:
-                    new_word = word + char
-                    new_score = self.model.score(new_word)
-                    next_hypotheses.append((new_score, new_word))
-            
-            # ソートして上位width件を残す
-            next_hypotheses.sort(key=lambda x: x[0], reverse=True)
-            current_hypotheses = next_hypotheses[:width]
+        order = np.asarray(select_top(scores, width, self.prune), dtype=np.intp)
+        parent_idx, char_idx = np.divmod(order, n_chars)
+        words = [parents[i] + possible_chars[j] for i, j in zip(parent_idx.tolist(), char_idx.tolist())]
+        return Beam(words, scores[order])
 
-        return current_hypotheses
+    def _beam_step_legacy(self, current_hypotheses, possible_chars, width, context):
+        """
+        旧実装のビームサーチ1ステップ (候補ごとに model.score を呼ぶ)
+        左文脈がある場合は「文脈 + 候補」の文字列全体を採点する。
+        :return: (score, word) のリスト (スコア降順、上位width件)
+        """
+        next_hypotheses = []
+        context_text = context.text
+
+        for word in current_hypotheses.words:
+            for char in possible_chars:
+                new_word = word + char
+                new_score = self.model.score(context_text + new_word)
+                next_hypotheses.append((new_score, new_word))
+
+        # ソートして上位width件を残す
+        next_hypotheses.sort(key=lambda x: x[0], reverse=True)
+        next_hypotheses = next_hypotheses[:width]
+        return Beam([word for _, word in next_hypotheses],
+                    np.array([score for score, _ in next_hypotheses], dtype=np.float64))
 
     def count_qwerty_combinations(self, index_seq: str) -> int:
         total_combinations = 1
         for index_char in index_seq:
             if index_char in self.QWERTY_MAP:
                 total_combinations *= len(self.QWERTY_MAP[index_char])
-        return total_combinations
\ No newline at end of file
+        return total_combinations
+
+
+class PredictionSession:
+    """
+    1クライアント (参加者・VR端末など) ぶんの入力状態
+
+    入力中のキー列・左文脈・ビームのキャッシュを持つ軽量なオブジェクト。
+    モデルなどの共有部分は WordPredictor が持つので、セッションはいくつ作っても安い。
+    """
+
+    def __init__(self, predictor, session_id):
+        self.predictor = predictor
+        self.session_id = session_id
+        # 現在入力中のインデックス列を保持するバッファ
+        self.current_index_sequence = ""
+        self.qwerty_combinations = 0
+        # 左文脈 (確定済みの単語列)。候補はこの状態からの続きとして採点する
+        self.context = predictor._bos_context
+        # 直前までの入力のビームを再利用するためのキャッシュ
+        self.frontier_cache = FrontierCache(max_bytes=predictor.session_cache_max_bytes)
+        # 入力している人の適応モデル (user_adaptation.UserCacheModel など)。None なら使わない
+        # 複数の人が同じセッションを使う場合 (既定セッション) は、ここに設定せず adapt の引数で渡す
+        self.adaptation = None
+        self.last_used = time.monotonic()
+
+    # =========================================================
+    #  入力処理メソッド
+    # =========================================================
+
+    def handle_index_input(self, index_val: int):
+        if 0 <= index_val <= 7: # キーマップに合わせて適宜調整
+             # 注意: QWERTY_MAPのキーは文字列の '0'~'9' ですが、
+             # handle_index_inputの引数がintの場合の変換はシステム全体で整合性をとってください。
+             # ここでは簡易的にstr変換して追加します
+            self._set_sequence(self.current_index_sequence + str(index_val))
+            print(f"[Predictor] updated index seq: {self.current_index_sequence}")
+        else:
+            print(f"[Predictor] Invalid index input: {index_val}")
+
+    def handle_backspace(self):
+        if len(self.current_index_sequence) > 0:
+            self._set_sequence(self.current_index_sequence[:-1])
+
+    def clear(self):
+        self.current_index_sequence = ""
+        self.qwerty_combinations = 0
+
+    def set_text_input(self, text: str):
+        self._set_sequence(self.predictor.text_to_sequence(text))
+
+    def get_current_sequence(self):
+        return self.current_index_sequence
+
+    def set_context(self, words):
+        """
+        左文脈 (同じフレーズで既に確定した単語) を設定する
+        前回の文脈に単語が追加されただけなら、前回の状態から追加分だけ読み進める。
+        :param words: 単語のリスト (空なら文頭から)
+        """
+        self.context = self.predictor.extend_context(self.context, words)
+
+    def _set_sequence(self, index_seq):
+        self.current_index_sequence = index_seq
+        self.qwerty_combinations = self.predictor.count_qwerty_combinations(index_seq)
+
+    # =========================================================
+    #  予測ロジック
+    # =========================================================
+
+    def predict_top_words(self, limit=6, beam_width=10000):
+        """
+        VRChat用など、文字列リストだけ欲しい場合に使用
+        """
+        top_candidates = self._decode(self.current_index_sequence, beam_width, self.context, limit=limit)
+        return [word for score, word in top_candidates]
+
+    def predict_top_words_with_scores(self, limit=6, beam_width=100000):
+        """
+        WEB UI用。スコア情報も含めて返す。
+        :return: [{"word": str, "score": float}, ...]
+        """
+        top_candidates = self._decode(self.current_index_sequence, beam_width, self.context, limit=limit)
+        return [{"word": word, "score": score} for score, word in top_candidates]
+
+    def predict_text(self, text, context=None, limit=6, beam_width=100000, latency_budget_ms=None, adaptation=None):
+        """
+        1リクエスト分の処理 (テキスト -> キー列変換・文脈設定・予測) をまとめて行う
+        途中の値はローカル変数で持つので、同じセッションへのリクエストが重なっても
+        別のリクエストの入力で予測してしまうことがない。
+        :param beam_width: ビーム幅 (int) または "auto"
+        :param latency_budget_ms: 1回の予測にかけてよい時間 (WordPredictor.decode 参照)
+        :param adaptation: このリクエストで使う適応モデル (None ならセッションの adaptation)
+        :return: (予測結果 [{"word", "score"}, ...], キー列, 組み合わせ数)
+        """
+        index_seq, ctx = self.prepare_text(text, context)
+        top_candidates = self._decode(index_seq, beam_width, ctx, latency_budget_ms, limit, adaptation)
+        predictions = [{"word": word, "score": score} for score, word in top_candidates]
+        return predictions, index_seq, self.predictor.count_qwerty_combinations(index_seq)
+
+    def prepare_text(self, text, context=None):
+        """
+        テキストをキー列に変換し、左文脈を設定する (predict_text の前半)
+        予測そのものを別のスレッドで行う場合 (prediction_service) は、これで入力を確定してから
+        predictor.decode を呼び、結果を adapt に通す。
+        :return: (キー列, LeftContext)
+        """
+        index_seq = self.predictor.text_to_sequence(text)
+        ctx = self.predictor.extend_context(self.context, context)
+        self.context = ctx
+        self._set_sequence(index_seq)
+        self.last_used = time.monotonic()
+        return index_seq, ctx
+
+    def _decode(self, index_seq, width, context, latency_budget_ms=None, limit=None, adaptation=None):
+        self.last_used = time.monotonic()
+        if not index_seq:
+            return []
+        candidates = self.predictor.decode(index_seq, width, context, self.frontier_cache, latency_budget_ms, limit)
+        return self.adapt(candidates, index_seq, context, limit, adaptation)
+
+    def adapt(self, candidates, index_seq, context, limit=None, adaptation=None):
+        """
+        適応モデルがあれば、予測候補の順位を補正する (predict_text の後半)
+        :param adaptation: このリクエストで使う適応モデル (None ならセッションの adaptation)
+        """
+        if adaptation is None:
+            adaptation = self.adaptation
+        if adaptation is not None:
+            # 確定済みの単語の傾向で順位を補正する (入力中のキー列で dict を引く程度の負荷)
+            candidates = adaptation.rescore(candidates, index_seq, context.words,
+                                            lambda word: self.predictor.score_word(word, context))[:limit]
+        return candidates